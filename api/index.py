@@ -1,32 +1,110 @@
+import time
+# Cold start: module import ka time (metrics.STARTUP["import"])
+_import_started = time.perf_counter()
 import os
-from flask import Flask, request, jsonify, render_template, session
+import logging
+from flask import Flask, Response, request, jsonify, render_template, session
+from flask.json.provider import DefaultJSONProvider
 
 # Vercel relative import fix
 try:
-    from . import storage 
+    from . import storage, hub, metrics, cache, search
 except (ImportError, ValueError):
     import storage
+    import hub
+    import metrics
+    import cache
+    import search
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"),
+                    format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+log = logging.getLogger("chat.app")
 
 # Path safety for Vercel
 base_dir = os.path.dirname(os.path.abspath(__file__))
 template_dir = os.path.join(base_dir, '../templates')
 static_dir = os.path.join(base_dir, '../static')
 
+class TimedJSONProvider(DefaultJSONProvider):
+    """JSON responses ka serialize time metrics mein jaata hai."""
+    def response(self, *args, **kwargs):
+        with metrics.phase("serialize"):
+            return super().response(*args, **kwargs)
+
 app = Flask(__name__, 
             template_folder=template_dir, 
             static_folder=static_dir)
+app.json = TimedJSONProvider(app)
 
 # Secret key for sessions
 app.secret_key = os.getenv("SESSION_KEY", "secret123")
 
+# Long-poll /inbox/wait kitni der tak hold kare (seconds)
+INBOX_WAIT_TIMEOUT = float(os.getenv("INBOX_WAIT_TIMEOUT", "20"))
+# /metrics ke liye "Authorization: Bearer <token>"; set na ho to /metrics band (401), cron jaisa
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+# /cron/maintenance ke liye; Vercel Cron khud "Authorization: Bearer $CRON_SECRET" bhejta hai
+CRON_SECRET = os.getenv("CRON_SECRET")
+# Ek cron call maintenance par itne seconds tak (function timeout se kam)
+CRON_TIME_BUDGET = float(os.getenv("CRON_TIME_BUDGET", "8"))
+
 # DATABASE INITIALIZATION
-# Isse tables tabhi banengi jab app pehli baar load hogi
-with app.app_context():
+# Import par koi DB kaam nahi - schema check pehli request par ek baar (storage.ensure_schema)
+
+# Har request ke saare storage calls ek pooled connection/transaction share karte hain.
+# Commit after_request mein (response jaane se pehle), teardown sirf cleanup/rollback.
+# Unhandled exception par bhi Flask after_request chalata hai (500 response ke saath),
+# isliye 5xx par commit nahi - rollback.
+@app.before_request
+def open_db_scope():
+    metrics.begin_request(request.endpoint, request.method)
+    storage.begin_request()
+    with metrics.phase("bootstrap"):
+        storage.ensure_schema()
+
+@app.after_request
+def commit_db_scope(response):
+    storage.end_request(error=response.status_code >= 500)
+    metrics.end_request(response)
+    return response
+
+@app.teardown_request
+def close_db_scope(error=None):
+    storage.end_request(error)
+    metrics.end_request()
+
+metrics.registry.gauge("chat_db_pool_in_use", "Pooled connections checked out.", lambda: storage.pool_stats()["in_use"])
+metrics.registry.gauge("chat_db_pool_size", "Open pooled connections.", lambda: storage.pool_stats()["size"])
+metrics.registry.gauge("chat_db_pool_waits_total", "Checkouts that had to wait for a free connection.",
+                       lambda: storage.pool_stats()["waits"], kind="counter")
+metrics.registry.gauge("chat_db_pool_timeouts_total", "Checkouts that timed out.",
+                       lambda: storage.pool_stats()["timeouts"], kind="counter")
+metrics.registry.gauge("chat_startup_seconds", "Cold start time per stage.",
+                       lambda: {(stage,): v for stage, v in metrics.STARTUP.items()}, labels=("stage",))
+metrics.registry.gauge("chat_inbox_waiters", "Long-poll requests currently waiting.", lambda: hub.get_hub().waiting())
+for _stat, _kind in (("hits", "counter"), ("misses", "counter"), ("evictions", "counter"),
+                     ("invalidations", "counter"), ("size", "gauge")):
+    metrics.registry.gauge(f"chat_cache_{_stat}" + ("_total" if _kind == "counter" else ""), f"User/block cache {_stat}.",
+                           lambda stat=_stat: {(name,): s[stat] for name, s in cache.stats().items()},
+                           kind=_kind, labels=("cache",))
+
+@app.route("/metrics")
+def metrics_endpoint():
+    if not METRICS_TOKEN or request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return {"error": "Unauthorized"}, 401
+    return Response(metrics.registry.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route("/cron/maintenance")
+def cron_maintenance():
+    """Partitions, compaction aur retention (jobs.py maintain) - vercel.json crons se."""
+    if not CRON_SECRET or request.headers.get("Authorization") != f"Bearer {CRON_SECRET}":
+        return {"error": "Unauthorized"}, 401
+    # Sirf cron ko chahiye - cold start par import nahi
     try:
-        storage.init_db()
-        print("Database initialized successfully!")
-    except Exception as e:
-        print(f"Database init error: {e}")
+        from . import jobs
+    except (ImportError, ValueError):
+        import jobs
+    return jobs.maintain(time_budget=CRON_TIME_BUDGET)
 
 @app.route("/")
 def home():
@@ -70,31 +148,83 @@ def logout():
 @app.route("/send", methods=["POST"])
 def send():
     if "user" not in session: return {"error": "Login required"}, 401
-    data = request.json
+    data = request.json if isinstance(request.json, dict) else {}
     sender = session["user"]
     receiver = data.get("to")
     msg = data.get("msg")
+    # store_messages jaisi validation
+    if not isinstance(receiver, str) or not receiver: return {"error": "Recipient required"}, 400
+    if not isinstance(msg, str) or not msg: return {"error": "Message required"}, 400
     
     if not storage.user_exists(receiver): return {"error": "User does not exist"}, 404
     if storage.is_blocked(receiver, sender): return {"error": "You are blocked"}, 403
     
-    storage.store_message(sender, receiver, msg)
+    if storage.store_message(sender, receiver, msg) is None:
+        return {"error": "Could not store message"}, 500
     return {"status": "sent"}
 
+@app.route("/send_batch", methods=["POST"])
+def send_batch():
+    """Ek request mein kai messages: {"messages": [{"to": ..., "msg": ...}, ...]}.
+    Har message ka result usi order mein milta hai."""
+    if "user" not in session: return {"error": "Login required"}, 401
+    data = request.json
+    items = data.get("messages") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return {"error": "messages list required"}, 400
+    if len(items) > storage.MAX_BATCH_SIZE:
+        return {"error": f"Max {storage.MAX_BATCH_SIZE} messages per batch"}, 413
+
+    results = storage.store_messages(session["user"], [(m.get("to"), m.get("msg")) if isinstance(m, dict) else (None, None)
+                                                       for m in items])
+    sent = sum(1 for r in results if "id" in r)
+    return {"sent": sent, "failed": len(results) - sent, "results": results}
+
+def mark_seen(user, chat_with, messages):
+    """Client ko mile chat_with ke messages ko read mark karo (sirf jab kuch naya aaya ho)."""
+    seen = [m["id"] for m in messages if m["from"] == chat_with]
+    if seen:
+        storage.mark_read(user, chat_with, max(seen))
+
 @app.route("/inbox/<chat_with>")
 def inbox(chat_with):
     if "user" not in session: return {"error": "Login required"}, 401
-    messages = storage.get_messages_between(session["user"], chat_with)
+    # ?after=<id> -> sirf naye messages, ?before=<id> -> purane (scroll back)
+    messages = storage.get_messages_between(session["user"], chat_with,
+                                            after=request.args.get("after", type=int),
+                                            before=request.args.get("before", type=int),
+                                            limit=request.args.get("limit", storage.PAGE_SIZE, type=int))
+    mark_seen(session["user"], chat_with, messages)
     return jsonify(messages)
 
+@app.route("/inbox/wait/<chat_with>")
+def inbox_wait(chat_with):
+    """Long-poll: naye messages aate hi return, warna timeout par khaali list."""
+    if "user" not in session: return {"error": "Login required"}, 401
+    user = session["user"]
+    after = request.args.get("after", 0, type=int)
+    timeout = min(max(request.args.get("timeout", INBOX_WAIT_TIMEOUT, type=float), 0), INBOX_WAIT_TIMEOUT)
+    deadline = time.monotonic() + timeout
+
+    # Subscribe pehle, DB check baad mein - beech mein aaya message miss nahi hoga
+    with hub.get_hub().subscribe(user) as sub:
+        while True:
+            sub.clear()
+            messages = storage.get_messages_between(user, chat_with, after=after)
+            mark_seen(user, chat_with, messages)
+            # Wait ke dauraan pool ka connection hold mat karo
+            storage.release_connection()
+            remaining = deadline - time.monotonic()
+            if messages or remaining <= 0 or not sub.wait(remaining):
+                return jsonify(messages)
+
 @app.route("/conversations")
 def conversations():
     if "user" not in session: return {"error": "Login required"}, 401
-    user = session["user"]
-    users = storage.get_conversations(user)
-    data = [{"user": u, 
-             "unread": storage.get_unread_count(user, u), 
-             "last": storage.get_last_message(user, u)} for u in users]
+    # ?before=<last.id> -> agla (purana) page
+    data = storage.get_conversation_summaries(session["user"],
+                                              limit=request.args.get("limit", storage.PAGE_SIZE, type=int),
+                                              before=request.args.get("before", type=int))
     return jsonify(data)
 
 @app.route("/chat")
@@ -108,5 +238,27 @@ def search_user(username):
     exists = storage.user_exists(username)
     return jsonify({"exists": exists})
 
+@app.route("/search/users")
+def search_users():
+    """Typeahead: ?q=<prefix> se shuru hone wale usernames."""
+    if "user" not in session: return {"error": "Login required"}, 401
+    users = storage.search_users(request.args.get("q", ""),
+                                 limit=request.args.get("limit", search.USER_LIMIT, type=int))
+    return jsonify(users)
+
+@app.route("/search/messages")
+def search_messages():
+    """Apni conversations mein ?q=<words>; ?before=<last id> -> agla page."""
+    if "user" not in session: return {"error": "Login required"}, 401
+    if not search.MESSAGE_SEARCH: return {"error": "Message search is disabled"}, 404
+    query = request.args.get("q", "").strip()
+    if not query: return {"error": "Search query required"}, 400
+    messages = storage.search_messages(session["user"], query,
+                                       before=request.args.get("before", type=int),
+                                       limit=request.args.get("limit", storage.PAGE_SIZE, type=int))
+    return jsonify(messages)
+
+metrics.record_startup("import", time.perf_counter() - _import_started)
+
 # Needed for Vercel deployment
 app = app
\ No newline at end of file
@@ -0,0 +1,269 @@
+"""Storage backends: Postgres (psycopg2) aur embedded SQLite.
+
+storage.py ki SQL psycopg2 style (%s / %(name)s) mein likhi hai aur dono
+backends par chalti hai. SQLite backend placeholders ko qmark/named style mein
+badalta hai, GREATEST/LEAST functions register karta hai aur WAL mode mein
+chalta hai. Backend DB_BACKEND=postgres|sqlite se chuna jaata hai; default
+postgres hai aur URL na ho to error - SQLite sirf DB_BACKEND=sqlite se, taaki
+galat configured deploy chupchaap local file par na chale. SQLITE_PATH ka
+default temp directory mein hai (repo ke bahar; Vercel par wahi writable hai).
+"""
+import os
+import re
+import time
+import sqlite3
+import datetime
+import tempfile
+import threading
+from functools import lru_cache
+from metrics import InstrumentedCursor, record_checkout
+
+# Connection pool settings (serverless ke liye chhota aur bounded)
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "5"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))            # free connection ka wait (s)
+POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "1800")) # itne purane connection recycle (s)
+POOL_CHECK_AFTER = float(os.getenv("DB_POOL_CHECK_AFTER", "30"))     # itni der idle ho to SELECT 1 (s)
+
+SQLITE_PATH = os.getenv("SQLITE_PATH") or os.path.join(tempfile.gettempdir(), "chat_app.db")
+
+
+class PoolError(Exception):
+    pass
+
+
+def get_db_url():
+    """Vercel Postgres URL ko clean aur format karne ke liye helper."""
+    url = os.environ.get('POSTGRES_URL') or os.environ.get('DATABASE_URL')
+    
+    if not url:
+        return None
+        
+    # Fix 1: psycopg2 'postgresql://' mangta hai, 'postgres://' nahi
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql://", 1)
+    
+    # Fix 2: Supabase ya extra params jo error dete hain unhe hatao
+    # Hum sirf base URL use karenge aur sslmode manually add karenge
+    base_url = url.split("?")[0]
+    return f"{base_url}?sslmode=require"
+
+
+# ---------------- CONNECTION POOL ----------------
+class ConnectionPool:
+    """Thread-safe pool: lazy connect, bounded size, health check aur max-lifetime recycling."""
+
+    def __init__(self, backend, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT,
+                 max_lifetime=POOL_MAX_LIFETIME, check_after=POOL_CHECK_AFTER):
+        self.backend = backend
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._idle = []   # (con, last_used), LIFO taaki garam connection pehle mile
+        self._born = {}   # id(con) -> created at
+        self._stats = dict.fromkeys(("opened", "closed", "recycled", "failed_checks",
+                                     "acquired", "waits", "timeouts"), 0)
+
+    def _count(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def getconn(self):
+        started = time.perf_counter()
+        con, opened = self._checkout()
+        record_checkout(time.perf_counter() - started, opened)
+        return con
+
+    def _checkout(self):
+        if not self._slots.acquire(blocking=False):
+            self._count("waits")
+            if not self._slots.acquire(timeout=self.timeout):
+                self._count("timeouts")
+                raise PoolError(f"connection pool exhausted ({self.max_size} in use)")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    con = self.backend.connect()
+                    with self._lock:
+                        self._born[id(con)] = time.monotonic()
+                        self._stats["opened"] += 1
+                        self._stats["acquired"] += 1
+                    return con, True
+                con, last_used = item
+                now = time.monotonic()
+                if self.backend.is_closed(con) or now - self._born.get(id(con), now) > self.max_lifetime:
+                    self._discard(con, "recycled")
+                    continue
+                if now - last_used > self.check_after and not self._ping(con):
+                    self._discard(con, "failed_checks")
+                    continue
+                self._count("acquired")
+                return con, False
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, con, close=False):
+        try:
+            if not close and not self.backend.is_closed(con) and self.backend.in_transaction(con):
+                con.rollback()
+        except Exception:
+            close = True
+        too_old = time.monotonic() - self._born.get(id(con), 0) > self.max_lifetime
+        if close or self.backend.is_closed(con) or too_old:
+            self._discard(con, "recycled" if too_old else None)
+        else:
+            with self._lock:
+                self._idle.append((con, time.monotonic()))
+        self._slots.release()
+
+    def _ping(self, con):
+        try:
+            cur = con.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            con.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, con, reason=None):
+        try:
+            con.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._born.pop(id(con), None)
+            self._stats["closed"] += 1
+            if reason:
+                self._stats[reason] += 1
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for con, _ in idle:
+            self._discard(con)
+
+    def stats(self):
+        with self._lock:
+            size, idle = len(self._born), len(self._idle)
+            return dict(self._stats, size=size, idle=idle, in_use=size - idle, max_size=self.max_size)
+
+
+# ---------------- POSTGRES ----------------
+class PostgresBackend:
+    name = "postgres"
+
+    def __init__(self, url):
+        import psycopg2
+        from psycopg2 import extras, extensions
+        class Cursor(InstrumentedCursor, extensions.cursor):
+            pass
+
+        class DictCursor(InstrumentedCursor, extras.DictCursor):
+            pass
+
+        self._psycopg2 = psycopg2
+        self._cursor, self._dict_cursor = Cursor, DictCursor
+        self._idle_status = extensions.TRANSACTION_STATUS_IDLE
+        self.url = url
+        self.pool = ConnectionPool(self)
+
+    def connect(self):
+        return self._psycopg2.connect(self.url)
+
+    def cursor(self, con, dict_rows=False):
+        return con.cursor(cursor_factory=self._dict_cursor if dict_rows else self._cursor)
+
+    def is_closed(self, con):
+        return bool(con.closed)
+
+    def in_transaction(self, con):
+        return con.info.transaction_status != self._idle_status
+
+
+# ---------------- SQLITE ----------------
+_PARAM_RE = re.compile(r"%\((\w+)\)s|%s|%%")
+
+@lru_cache(maxsize=512)
+def _sqlite_sql(sql):
+    """%s -> ?, %(name)s -> :name, %% -> %"""
+    def repl(m):
+        if m.group(1):
+            return ":" + m.group(1)
+        return "?" if m.group(0) == "%s" else "%"
+    return _PARAM_RE.sub(repl, sql)
+
+
+class SQLiteCursor(InstrumentedCursor, sqlite3.Cursor):
+    def execute(self, sql, params=None):
+        return super().execute(_sqlite_sql(sql), params)
+
+    def executemany(self, sql, seq):
+        return super().executemany(_sqlite_sql(sql), seq)
+
+
+def _parse_timestamp(value):
+    return datetime.datetime.fromisoformat(value.decode())
+
+sqlite3.register_adapter(datetime.datetime, lambda d: d.isoformat(" "))
+sqlite3.register_converter("TIMESTAMP", _parse_timestamp)
+sqlite3.register_converter("DATETIME", _parse_timestamp)
+
+
+class SQLiteBackend:
+    """Embedded SQLite: WAL mode, statement cache (prepared statements), koi network nahi."""
+    name = "sqlite"
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.pool = ConnectionPool(self)
+
+    def connect(self):
+        con = sqlite3.connect(self.path, timeout=POOL_TIMEOUT, detect_types=sqlite3.PARSE_DECLTYPES,
+                              check_same_thread=False, cached_statements=256)
+        con.execute("PRAGMA journal_mode=WAL")
+        con.execute("PRAGMA synchronous=NORMAL")
+        con.execute(f"PRAGMA busy_timeout={int(POOL_TIMEOUT * 1000)}")
+        con.create_function("GREATEST", -1, max, deterministic=True)
+        con.create_function("LEAST", -1, min, deterministic=True)
+        return con
+
+    def cursor(self, con, dict_rows=False):
+        cur = con.cursor(SQLiteCursor)
+        if dict_rows:
+            cur.row_factory = sqlite3.Row
+        return cur
+
+    def is_closed(self, con):
+        return False
+
+    def in_transaction(self, con):
+        return con.in_transaction
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    """Backend (aur uska pool) pehli zarurat par banta hai - cold start par koi connection nahi."""
+    global _backend
+    if _backend is None or _backend.pool.pid != os.getpid():
+        with _backend_lock:
+            if _backend is None or _backend.pool.pid != os.getpid():
+                kind = os.getenv("DB_BACKEND") or "postgres"
+                if kind == "postgres":
+                    url = get_db_url()
+                    if not url:
+                        raise ValueError("Database URL missing! Dashboard se Postgres connect karein.")
+                    _backend = PostgresBackend(url)
+                elif kind == "sqlite":
+                    _backend = SQLiteBackend()
+                else:
+                    raise ValueError(f"Unknown DB_BACKEND: {kind}")
+    return _backend
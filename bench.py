@@ -0,0 +1,661 @@
+"""Load-test aur benchmark harness for the Flask API.
+
+Users aur messages seed karta hai (Zipf skew: kuch users aur kuch
+conversations bahut zyada active), asli endpoints (/send, /inbox,
+/conversations, /search_user) ko concurrently chalata hai aur p50/p95/p99
+latency, throughput aur queries per request report karta hai.
+
+    python bench.py run --users 200 --messages 20000 --workers 8 --duration 20 --out before.json
+    python bench.py run --mode http --server-workers 2 --workers 16 --duration 20
+    python bench.py trace --users 100 --ops 5000 --rate 200 --out trace.jsonl
+    python bench.py replay trace.jsonl --workers 8 --out replay.json
+    python bench.py compare before.json after.json
+    python bench.py crypto --against before.json
+
+Database wahi hai jo env se configure ho (DB_BACKEND / POSTGRES_URL /
+SQLITE_PATH); --sqlite PATH ek alag SQLite file par chalata hai.
+
+Trace format (JSONL, ek op per line, "t" = start se seconds):
+    {"t": 0.12, "user": "bench_u3", "op": "send", "to": "bench_u7", "msg": "hi"}
+    {"t": 0.30, "user": "bench_u7", "op": "inbox", "with": "bench_u3"}
+    {"t": 0.41, "user": "bench_u7", "op": "older", "with": "bench_u3"}
+    {"t": 0.50, "user": "bench_u3", "op": "conversations"}
+    {"t": 0.60, "user": "bench_u3", "op": "search", "q": "bench_u1"}
+    {"t": 0.70, "user": "bench_u3", "op": "send_batch", "messages": [{"to": "bench_u1", "msg": "hi"}]}
+    {"t": 0.80, "user": "bench_u3", "op": "typeahead", "q": "bench_u1"}
+    {"t": 0.90, "user": "bench_u3", "op": "find", "q": "kal milte"}
+"inbox" user ke last seen id ke baad ke messages maangta hai (ya "after" do),
+"older" us conversation mein scroll back karta hai.
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import signal
+import socket
+import bisect
+import argparse
+import datetime
+import threading
+import subprocess
+import http.client
+from urllib.parse import quote
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, ROOT)
+
+USER_PREFIX = "bench_u"
+BENCH_PASSWORD = "bench"
+DEFAULT_MIX = "inbox=50,conversations=20,send=20,older=5,search=5"
+# --mix mein "batch=N" ho to har batch op itne messages /send_batch par bhejta hai
+# "typeahead" (/search/users, naam ka prefix) aur "find" (/search/messages) bhi --mix mein de sakte hain
+BATCH_SIZE = 50
+WORDS = ("hey", "ok", "kal", "milte", "hain", "haan", "nahi", "done", "lol", "theek", "hai",
+         "meeting", "at", "5", "call", "me", "bhai", "thanks", "sure", "where", "are", "you")
+
+
+def user_name(i):
+    return f"{USER_PREFIX}{i}"
+
+
+def load_app():
+    """App import (env pehle set ho chuka ho). Seeding app se pehle DB likhta hai, to
+    schema deploy ki tarah yahin migrate hota hai (app khud pehli request par karta)."""
+    from api.index import app
+    import storage
+    import metrics
+    storage.init_db()
+    return app, storage, metrics
+
+
+# ---------------- WORKLOAD ----------------
+class Workload:
+    """Synthetic traffic: sender aur receiver dono Zipf distribution se, taaki
+    kuch users aur conversations baaki sab se kahin zyada busy hon."""
+
+    def __init__(self, users, skew=1.1, mix=DEFAULT_MIX, seed=None):
+        self.users = users
+        self.rng = random.Random(seed)
+        total, self._cdf = 0.0, []
+        for rank in range(users):
+            total += 1.0 / (rank + 1) ** skew
+            self._cdf.append(total)
+        self._ops, weights = [], []
+        for part in mix.split(","):
+            name, _, weight = part.partition("=")
+            self._ops.append(name.strip())
+            weights.append(float(weight or 1))
+        self._op_cdf = [sum(weights[:i + 1]) for i in range(len(weights))]
+
+    def user(self):
+        i = bisect.bisect_left(self._cdf, self.rng.random() * self._cdf[-1])
+        return user_name(min(i, self.users - 1))
+
+    def pair(self):
+        sender = self.user()
+        receiver = self.user()
+        while receiver == sender and self.users > 1:
+            receiver = self.user()
+        return sender, receiver
+
+    def message(self):
+        return " ".join(self.rng.choice(WORDS) for _ in range(int(self.rng.lognormvariate(1.8, 0.7)) + 1))
+
+    def op(self):
+        kind = self._ops[bisect.bisect_left(self._op_cdf, self.rng.random() * self._op_cdf[-1])]
+        user, other = self.pair()
+        if kind == "send":
+            return {"user": user, "op": "send", "to": other, "msg": self.message()}
+        if kind == "batch":
+            return {"user": user, "op": "send_batch",
+                    "messages": [{"to": self.user(), "msg": self.message()} for _ in range(BATCH_SIZE)]}
+        if kind in ("inbox", "older"):
+            return {"user": user, "op": kind, "with": other}
+        if kind == "search":
+            return {"user": user, "op": "search", "q": other}
+        if kind == "typeahead":
+            return {"user": user, "op": "typeahead", "q": other[:self.rng.randint(len(USER_PREFIX), len(other))]}
+        if kind == "find":
+            return {"user": user, "op": "find", "q": " ".join(self.rng.sample(WORDS, self.rng.randint(1, 2)))}
+        return {"user": user, "op": kind}
+
+
+def seed(storage, users, messages, skew, rng_seed):
+    """Bench users + Zipf-skewed messages. Password hash ek hi baar banta hai (pbkdf2 mehnga hai)."""
+    from werkzeug.security import generate_password_hash
+    hashed = generate_password_hash(BENCH_PASSWORD)
+    with storage.transaction() as cur:
+        cur.executemany("INSERT INTO users (username, email, password) VALUES (%s, %s, %s) ON CONFLICT DO NOTHING",
+                        [(user_name(i), f"{user_name(i)}@bench.local", hashed) for i in range(users)])
+    work = Workload(users, skew, seed=rng_seed)
+    started = time.perf_counter()
+    done = 0
+    while done < messages:
+        by_sender = {}
+        for _ in range(min(5000, messages - done)):
+            sender, receiver = work.pair()
+            by_sender.setdefault(sender, []).append((receiver, work.message()))
+            done += 1
+        with storage.transaction():
+            for sender, items in by_sender.items():
+                storage.store_messages(sender, items)
+    elapsed = time.perf_counter() - started
+    print(f"Seeded {users} users, {messages} messages in {elapsed:.1f}s", file=sys.stderr)
+
+
+# ---------------- DRIVERS ----------------
+class ClientSession:
+    """Flask test client, session mein user pehle se set (login ka pbkdf2 skip)."""
+
+    def __init__(self, app, user):
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["user"] = user
+
+    def call(self, method, path, body=None):
+        resp = self.client.open(path, method=method, json=body)
+        return resp.status_code, resp.get_json(silent=True)
+
+
+class HttpSession:
+    """Keep-alive HTTP connection ek server worker tak, signed session cookie ke saath."""
+
+    def __init__(self, host, port, cookie):
+        self.host, self.port, self.cookie = host, port, cookie
+        self.con = None
+
+    def call(self, method, path, body=None):
+        headers = {"Cookie": f"session={self.cookie}"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        for attempt in (0, 1):
+            try:
+                if self.con is None:
+                    self.con = http.client.HTTPConnection(self.host, self.port, timeout=30)
+                self.con.request(method, path, body=payload, headers=headers)
+                resp = self.con.getresponse()
+                data = resp.read()
+                try:
+                    return resp.status, json.loads(data) if data else None
+                except ValueError:
+                    return resp.status, None
+            except (http.client.HTTPException, OSError):
+                self.con.close()
+                self.con = None
+                if attempt:
+                    raise
+
+
+class Driver:
+    def __init__(self, app, servers=None):
+        self.app = app
+        self.servers = servers or []
+        self._serializer = app.session_interface.get_signing_serializer(app) if servers else None
+        self._next = 0
+
+    def session(self, user):
+        if not self.servers:
+            return ClientSession(self.app, user)
+        host, port = self.servers[self._next % len(self.servers)]
+        self._next += 1
+        return HttpSession(host, port, self._serializer.dumps({"user": user}))
+
+
+class VirtualUser:
+    """Ek user ka client-side state: har partner ke liye last seen / oldest id."""
+
+    def __init__(self, driver, name):
+        self.name = name
+        self.session = driver.session(name)
+        self.last = {}
+        self.oldest = {}
+
+    def run(self, op):
+        kind = op["op"]
+        if kind == "send":
+            return "send", self.session.call("POST", "/send", {"to": op["to"], "msg": op["msg"]})
+        if kind == "send_batch":
+            return "send_batch", self.session.call("POST", "/send_batch", {"messages": op["messages"]})
+        if kind == "conversations":
+            return "conversations", self.session.call("GET", "/conversations")
+        if kind == "search":
+            return "search_user", self.session.call("GET", "/search_user/" + quote(op["q"]))
+        if kind == "typeahead":
+            return "search_users", self.session.call("GET", "/search/users?q=" + quote(op["q"]))
+        if kind == "find":
+            return "search_messages", self.session.call("GET", "/search/messages?q=" + quote(op["q"]))
+        other = op["with"]
+        if kind == "older":
+            before = op.get("before", self.oldest.get(other))
+            path = f"/inbox/{quote(other)}" + (f"?before={before}" if before else "")
+            status, data = self.session.call("GET", path)
+            if isinstance(data, list) and data:
+                self.oldest[other] = data[0]["id"]
+            return "inbox_older", (status, data)
+        after = op.get("after", self.last.get(other))
+        path = f"/inbox/{quote(other)}" + (f"?after={after}" if after else "")
+        status, data = self.session.call("GET", path)
+        if isinstance(data, list) and data:
+            self.last[other] = data[-1]["id"]
+            self.oldest.setdefault(other, data[0]["id"])
+        return "inbox_delta" if after else "inbox_page", (status, data)
+
+
+# ---------------- RECORDING ----------------
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.requests = 0
+
+    def record(self, endpoint, seconds, ok, measured=True):
+        with self._lock:
+            self.requests += 1
+            if not measured:
+                return
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            if not ok:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+
+def percentile(values, pct):
+    """Nearest rank: sorted values mein ceil(pct% * n)-va value."""
+    if not values:
+        return None
+    return values[max(0, math.ceil(pct * len(values) / 100) - 1)]
+
+
+def summarize(values, errors, duration):
+    values = sorted(values)
+    ms = lambda v: round(v * 1000, 3) if v is not None else None
+    return {
+        "count": len(values),
+        "errors": errors,
+        "throughput_rps": round(len(values) / duration, 2) if duration else None,
+        "mean_ms": ms(sum(values) / len(values)) if values else None,
+        "p50_ms": ms(percentile(values, 50)),
+        "p95_ms": ms(percentile(values, 95)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]) if values else None,
+    }
+
+
+def timed(user, op, recorder, measured):
+    started = time.perf_counter()
+    try:
+        endpoint, (status, _) = user.run(op)
+        ok = status < 500
+    except Exception:
+        endpoint, ok = op["op"], False
+    recorder.record(endpoint, time.perf_counter() - started, ok, measured)
+
+
+# ---------------- HTTP SERVERS ----------------
+def serve(args):
+    """Ek server worker (bench.py run --mode http isse subprocess mein chalata hai)."""
+    from werkzeug.serving import make_server
+    app, storage, metrics = load_app()
+    server = make_server("127.0.0.1", args.port, app, threaded=True)
+    baseline = metrics.query_total()
+
+    def stop(*_):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+    if args.stats_file:
+        with open(args.stats_file, "w") as f:
+            json.dump({"queries": metrics.query_total() - baseline, "pool": storage.pool_stats()}, f)
+
+
+def start_servers(count, base_port):
+    procs = []
+    for i in range(count):
+        stats_file = os.path.join(ROOT, f".bench_server_{base_port + i}.json")
+        proc = subprocess.Popen([sys.executable, os.path.abspath(__file__), "serve", "--port", str(base_port + i),
+                                 "--stats-file", stats_file], stdout=subprocess.DEVNULL)
+        procs.append((proc, stats_file))
+    # Port khulne tak wait (app import + migrations mein time lagta hai)
+    deadline = time.time() + 60
+    for i, (proc, _) in enumerate(procs):
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", base_port + i), timeout=1).close()
+                break
+            except OSError:
+                if proc.poll() is not None or time.time() > deadline:
+                    stop_servers(procs)
+                    raise RuntimeError(f"bench server on port {base_port + i} failed to start")
+                time.sleep(0.1)
+    return procs
+
+
+def stop_servers(procs):
+    stats = {"queries": 0, "pool": []}
+    for proc, stats_file in procs:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+        try:
+            with open(stats_file) as f:
+                data = json.load(f)
+            os.remove(stats_file)
+            stats["queries"] += data["queries"]
+            stats["pool"].append(data["pool"])
+        except (OSError, ValueError):
+            stats["queries"] = None
+    return stats
+
+
+# ---------------- COMMANDS ----------------
+def configure_env(args):
+    if getattr(args, "sqlite", None):
+        os.environ["DB_BACKEND"] = "sqlite"
+        os.environ["SQLITE_PATH"] = os.path.abspath(args.sqlite)
+
+
+def execute(args, worker_fn):
+    """Seed, (optionally) servers start, workers chalao aur result dict banao."""
+    app, storage, metrics = load_app()
+    if args.messages:
+        seed(storage, args.users, args.messages, args.skew, args.seed)
+
+    procs, servers = [], None
+    if args.mode == "http":
+        if args.url:
+            host, _, port = args.url.replace("http://", "").rstrip("/").partition(":")
+            servers = [(host, int(port or 80))]
+        else:
+            procs = start_servers(args.server_workers, args.port)
+            servers = [("127.0.0.1", args.port + i) for i in range(args.server_workers)]
+    driver = Driver(app, servers)
+
+    recorder = Recorder()
+    queries_before = metrics.query_total()
+    phases_before = phase_snapshot(metrics)
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker_fn, args=(i, driver, recorder)) for i in range(args.workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    if procs:
+        server_stats = stop_servers(procs)
+        queries, pool = server_stats["queries"], server_stats["pool"]
+    elif servers:
+        queries, pool = None, None
+    else:
+        queries, pool = metrics.query_total() - queries_before, storage.pool_stats()
+
+    duration = max(wall - getattr(args, "warmup", 0), 1e-9)
+    all_latencies = [v for vals in recorder.latencies.values() for v in vals]
+    total = summarize(all_latencies, sum(recorder.errors.values()), duration)
+    total["queries_per_request"] = round(queries / recorder.requests, 2) if queries is not None and recorder.requests else None
+    return {
+        "meta": {
+            "command": args.command,
+            "commit": git_commit(),
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "backend": storage.get_backend().name,
+            "mode": args.mode,
+            "workers": args.workers,
+            "server_workers": args.server_workers if args.mode == "http" and not args.url else None,
+            "users": args.users,
+            "seeded_messages": args.messages,
+            "skew": args.skew,
+            "duration_s": round(wall, 2),
+        },
+        "summary": total,
+        "endpoints": {name: summarize(vals, recorder.errors.get(name, 0), duration)
+                      for name, vals in sorted(recorder.latencies.items())},
+        "pool": pool,
+        # Client mode: server-side phase time (connect/execute/fetch/commit/crypto/serialize) per request
+        "phases_ms_per_request": phase_breakdown(phases_before, phase_snapshot(metrics)) if not servers else None,
+    }
+
+
+def phase_snapshot(metrics):
+    """metrics registry se {(endpoint, phase): seconds} aur {endpoint: requests}."""
+    with metrics.registry.lock:
+        phases = dict(metrics.phase_seconds.values)
+        requests = {}
+        for (endpoint, _, _), n in metrics.requests_total.values.items():
+            requests[endpoint] = requests.get(endpoint, 0) + n
+    return {"phases": phases, "requests": requests}
+
+
+def phase_breakdown(before, after):
+    out = {}
+    for (endpoint, phase), seconds in sorted(after["phases"].items()):
+        n = after["requests"].get(endpoint, 0) - before["requests"].get(endpoint, 0)
+        spent = seconds - before["phases"].get((endpoint, phase), 0)
+        if n > 0 and spent > 0:
+            out.setdefault(endpoint, {})[phase] = round(spent / n * 1000, 3)
+    return out
+
+
+def cmd_run(args):
+    deadline_box = {}
+
+    def worker(i, driver, recorder):
+        work = Workload(args.users, args.skew, args.mix, seed=(args.seed or 0) * 1000 + i)
+        users = {}
+        start = time.perf_counter()
+        deadline = deadline_box.setdefault("deadline", start + args.warmup + args.duration)
+        ops = 0
+        while time.perf_counter() < deadline and (not args.ops or ops < args.ops // args.workers):
+            op = work.op()
+            user = users.get(op["user"]) or users.setdefault(op["user"], VirtualUser(driver, op["user"]))
+            timed(user, op, recorder, measured=time.perf_counter() - start >= args.warmup)
+            ops += 1
+
+    return execute(args, worker)
+
+
+def cmd_replay(args):
+    with open(args.trace) as f:
+        ops = [json.loads(line) for line in f if line.strip()]
+    # Ek user ke saare ops ek hi worker par, order wahi rahe
+    lanes = [[] for _ in range(args.workers)]
+    for op in ops:
+        lanes[hash(op["user"]) % args.workers].append(op)
+    start_box = {}
+
+    def worker(i, driver, recorder):
+        start = start_box.setdefault("start", time.perf_counter())
+        users = {}
+        for op in sorted(lanes[i], key=lambda o: o.get("t", 0)):
+            if args.speed > 0:
+                delay = start + op.get("t", 0) / args.speed - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            user = users.get(op["user"]) or users.setdefault(op["user"], VirtualUser(driver, op["user"]))
+            timed(user, op, recorder, measured=True)
+
+    args.warmup = 0
+    args.users = args.users or len({op["user"] for op in ops})
+    return execute(args, worker)
+
+
+def cmd_crypto(args):
+    """Encryption ki cost: per message aur per inbox page (decrypt_many)."""
+    from cryptography.fernet import Fernet
+    if not (os.getenv("ENCRYPTION_KEYS") or os.getenv("ENCRYPTION_KEY")):
+        os.environ["ENCRYPTION_KEYS"] = "1:" + Fernet.generate_key().decode()
+    import crypto
+    import storage
+
+    work = Workload(10, seed=args.seed)
+    texts = [work.message() for _ in range(args.messages)]
+    page = storage.PAGE_SIZE
+
+    started = time.perf_counter()
+    encrypted = crypto.encrypt_many(texts)
+    encrypt_s = time.perf_counter() - started
+    started = time.perf_counter()
+    for i in range(0, len(encrypted), page):
+        crypto.decrypt_many(encrypted[i:i + page])
+    decrypt_s = time.perf_counter() - started
+    # Purana tareeka: har call par naya Fernet object
+    key = Fernet.generate_key()
+    sample = texts[:min(len(texts), 2000)]
+    started = time.perf_counter()
+    for text in sample:
+        Fernet(key).encrypt(text.encode())
+    uncached_s = time.perf_counter() - started
+
+    result = {
+        "messages": len(texts),
+        "encrypt_us_per_message": round(encrypt_s / len(texts) * 1e6, 2),
+        "decrypt_us_per_message": round(decrypt_s / len(texts) * 1e6, 2),
+        "decrypt_ms_per_page": round(decrypt_s / len(texts) * page * 1000, 3),
+        "uncached_encrypt_us_per_message": round(uncached_s / len(sample) * 1e6, 2),
+        "page_size": page,
+    }
+    if args.against:
+        with open(args.against) as f:
+            inbox = json.load(f)["endpoints"].get("inbox_page")
+        if inbox and inbox.get("p50_ms"):
+            result["share_of_inbox_page_p50"] = round(result["decrypt_ms_per_page"] / inbox["p50_ms"], 4)
+    print(json.dumps(result, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+def cmd_trace(args):
+    work = Workload(args.users, args.skew, args.mix, seed=args.seed)
+    out = open(args.out, "w") if args.out else sys.stdout
+    t = 0.0
+    for _ in range(args.ops):
+        t += work.rng.expovariate(args.rate)
+        out.write(json.dumps(dict(work.op(), t=round(t, 4))) + "\n")
+    if args.out:
+        out.close()
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        old = json.load(f)
+    with open(args.candidate) as f:
+        new = json.load(f)
+    rows = [("TOTAL", old["summary"], new["summary"])]
+    rows += [(name, old["endpoints"].get(name), new["endpoints"][name]) for name in new["endpoints"]]
+    regressions = 0
+    print(f"{'endpoint':<16}{'metric':<22}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name, a, b in rows:
+        if not a:
+            continue
+        for metric, higher_is_better in (("p50_ms", False), ("p95_ms", False), ("p99_ms", False),
+                                         ("throughput_rps", True), ("queries_per_request", False)):
+            va, vb = a.get(metric), b.get(metric)
+            if va is None or vb is None:
+                continue
+            change = (vb - va) / va * 100 if va else 0.0
+            worse = change < -args.threshold if higher_is_better else change > args.threshold
+            regressions += worse
+            flag = "  REGRESSION" if worse else ""
+            print(f"{name:<16}{metric:<22}{va:>12}{vb:>12}{change:>+9.1f}%{flag}")
+    return 1 if regressions else 0
+
+
+def print_report(result):
+    s = result["summary"]
+    print(f"\n{result['meta']['backend']} / {result['meta']['mode']}: {s['count']} requests, "
+          f"{s['throughput_rps']} req/s, {s['errors']} errors, {s['queries_per_request']} queries/request")
+    print(f"{'endpoint':<16}{'count':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, e in result["endpoints"].items():
+        print(f"{name:<16}{e['count']:>8}{e['throughput_rps']:>10}{e['p50_ms']:>10}{e['p95_ms']:>10}{e['p99_ms']:>10}{e['errors']:>8}")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    def common(p):
+        p.add_argument("--mode", choices=("client", "http"), default="client",
+                       help="client = Flask test client in-process, http = real HTTP server workers")
+        p.add_argument("--workers", type=int, default=8, help="concurrent client threads")
+        p.add_argument("--server-workers", type=int, default=2, help="http mode: server processes")
+        p.add_argument("--port", type=int, default=8700, help="http mode: first server port")
+        p.add_argument("--url", help="http mode: pehle se chal raha server (e.g. http://127.0.0.1:8000)")
+        p.add_argument("--sqlite", help="is SQLite file par chalao (DB_BACKEND=sqlite)")
+        p.add_argument("--users", type=int, default=100)
+        p.add_argument("--messages", type=int, default=0, help="itne messages pehle seed karo")
+        p.add_argument("--skew", type=float, default=1.1, help="Zipf exponent")
+        p.add_argument("--seed", type=int, default=1)
+        p.add_argument("--out", help="result JSON yahan save karo")
+
+    p = sub.add_parser("run", help="synthetic load")
+    common(p)
+    p.add_argument("--duration", type=float, default=10)
+    p.add_argument("--warmup", type=float, default=1)
+    p.add_argument("--ops", type=int, default=0, help="duration se pehle itne ops par ruk jao")
+    p.add_argument("--mix", default=DEFAULT_MIX)
+
+    p = sub.add_parser("replay", help="JSONL trace replay")
+    common(p)
+    p.add_argument("trace")
+    p.add_argument("--speed", type=float, default=0, help="1 = asli timing, 0 = jitna tez ho sake")
+    p.set_defaults(users=0)
+
+    p = sub.add_parser("trace", help="synthetic JSONL trace banao")
+    p.add_argument("--users", type=int, default=100)
+    p.add_argument("--ops", type=int, default=1000)
+    p.add_argument("--rate", type=float, default=100, help="ops per second")
+    p.add_argument("--skew", type=float, default=1.1)
+    p.add_argument("--mix", default=DEFAULT_MIX)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--out")
+
+    p = sub.add_parser("crypto", help="encrypt/decrypt cost per message aur per inbox page")
+    p.add_argument("--messages", type=int, default=20000)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--against", help="run ka result JSON: inbox_page p50 ke hisaab se share bhi batao")
+    p.add_argument("--out")
+
+    p = sub.add_parser("compare", help="do result files compare karo")
+    p.add_argument("baseline")
+    p.add_argument("candidate")
+    p.add_argument("--threshold", type=float, default=10, help="itne %% se kharab = regression")
+
+    p = sub.add_parser("serve", help=argparse.SUPPRESS)
+    p.add_argument("--port", type=int, required=True)
+    p.add_argument("--stats-file")
+
+    args = parser.parse_args(argv)
+    configure_env(args)
+    if args.command == "trace":
+        return cmd_trace(args)
+    if args.command == "compare":
+        return cmd_compare(args)
+    if args.command == "crypto":
+        return cmd_crypto(args)
+    if args.command == "serve":
+        return serve(args)
+
+    result = cmd_run(args) if args.command == "run" else cmd_replay(args)
+    print_report(result)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""Chhota in-process read-through cache (LRU + TTL) users aur blocks ke liye.
+
+Users aur block relationships bahut kam badalte hain par har message par
+padhe jaate hain. Entries TTL tak rehti hain (negative entries - unknown
+username, "block nahi hai" - ka TTL chhota), size bounded hai (LRU eviction),
+aur create_user / block_user commit ke baad explicitly invalidate karte hain. Postgres hub ho to
+invalidation NOTIFY se baaki instances tak jaati hai, par sirf un processes
+mein pahunchti hai jinka hub listener chal raha hai (long-poll /inbox/wait se
+start hota hai). Listener ka apna connection DB_POOL_MAX_SIZE ke bahar hai,
+isliye sirf cache ke liye use start karna opt-in hai (CACHE_LISTEN=1); warna
+doosre processes ko badlav TTL ke baad dikhega. Yeh block enforcement par bhi
+lagta hai: naya block doosre instances par CACHE_NEGATIVE_TTL tak (purani
+"block nahi" entry) lagu nahi hota - isse kam window chahiye to CACHE_LISTEN=1.
+
+  CACHE_MAX_SIZE=10000      har cache mein itni entries
+  CACHE_TTL=300             seconds; 0 = cache band
+  CACHE_NEGATIVE_TTL=30     "user nahi mila" / "block nahi hai" kitni der yaad rahe
+  CACHE_LISTEN=0            1 = pehli cache fill par hub listener start karo
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+
+CACHE_MAX_SIZE = int(os.getenv("CACHE_MAX_SIZE", "10000"))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+CACHE_NEGATIVE_TTL = float(os.getenv("CACHE_NEGATIVE_TTL", "30"))
+CACHE_LISTEN = os.getenv("CACHE_LISTEN", "").lower() in ("1", "true", "yes", "on")
+
+MISSING = object()
+
+
+class LRUCache:
+    """Thread-safe LRU + TTL. Falsy values negative_ttl tak rehti hain."""
+
+    def __init__(self, name, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL, negative_ttl=CACHE_NEGATIVE_TTL):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = min(negative_ttl, ttl)
+        # Har invalidation par badhta hai - read ke dauraan invalidation hui ho to
+        # us read ka (shayad purana) result cache nahi hota
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._data = OrderedDict()   # key -> (value, expires_at)
+        self._stats = dict.fromkeys(("hits", "misses", "evictions", "expired", "invalidations"), 0)
+
+    def get(self, key):
+        """Cached value, ya MISSING."""
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                if item[1] > time.monotonic():
+                    self._data.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return item[0]
+                del self._data[key]
+                self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            return MISSING
+
+    def set(self, key, value, generation=None):
+        """generation = DB read shuru hone se pehle ka self.generation."""
+        ttl = self.ttl if value else self.negative_ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            self._data[key] = (value, time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def invalidate(self, key=MISSING):
+        """Ek key, ya key na do to poora cache."""
+        with self._lock:
+            self.generation += 1
+            self._stats["invalidations"] += 1
+            if key is MISSING:
+                self._data.clear()
+            else:
+                self._data.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, size=len(self._data), max_size=self.max_size)
+
+
+# username -> exists
+users = LRUCache("users")
+# (blocker, blocked) -> blocked? "Block nahi hai" negative entry hai - listener na ho to
+# naya block doosre instances par isi der baad lagta hai, isliye chhota TTL
+blocks = LRUCache("blocks")
+
+CACHES = {c.name: c for c in (users, blocks)}
+
+
+def invalidate(name, key=MISSING):
+    CACHES[name].invalidate(key)
+
+
+def apply_invalidation(name, key):
+    """Hub se aayi invalidation. name None = sab caches (listener reconnect, kuch miss hua ho sakta hai)."""
+    if name is None:
+        for c in CACHES.values():
+            c.invalidate()
+    elif name in CACHES:
+        # JSON mein tuple list ban jaata hai
+        CACHES[name].invalidate(tuple(key) if isinstance(key, list) else key)
+
+
+def stats():
+    return {name: c.stats() for name, c in CACHES.items()}
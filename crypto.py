@@ -1,14 +1,137 @@
+"""Messages ka encryption at rest (Fernet, versioned keys).
+
+Vercel Environment Variable:
+    ENCRYPTION_KEYS="2:<fernet key>,1:<purani key>"
+Pehli key se naya data encrypt hota hai, baaki sirf purana data padhne ke
+liye hain (rotation). Har encrypted row ke saath uska key_id store hota hai,
+to decrypt seedha sahi key se hota hai, aur `python jobs.py reencrypt`
+purani key wali rows ko current key par le aata hai. Sirf ENCRYPTION_KEY
+set ho to woh key id 1 hai.
+
+Koi key na ho to encryption band hai (plaintext, key_id NULL) - har process
+ki alag random key kabhi nahi banti, warna dusre instances apne hi messages
+nahi padh paate.
+
+Nayi key: python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"
+"""
 import os
-from cryptography.fernet import Fernet
+import logging
+import threading
+
+log = logging.getLogger("chat.crypto")
+
+# Decrypt na ho paaye (key hata di gayi, data corrupt) to poora page fail karne ki jagah yeh
+UNREADABLE = "[message could not be decrypted]"
+
+
+class KeyRing:
+    """key_id -> cached Fernet. primary = naye data ki key."""
+
+    def __init__(self, spec):
+        # cryptography ka import pehli key use par - cold start par sirf us request ko lagta hai jise chahiye
+        from cryptography.fernet import Fernet, MultiFernet
+        self.fernets = {}
+        self.primary = None
+        for part in (p.strip() for p in spec.split(",")):
+            if not part:
+                continue
+            key_id, sep, key = part.partition(":")
+            if not sep or not key_id.strip().isdigit():
+                raise ValueError("ENCRYPTION_KEYS entries must look like <id>:<fernet key>")
+            key_id = int(key_id)
+            if key_id in self.fernets:
+                raise ValueError(f"ENCRYPTION_KEYS has key id {key_id} twice")
+            self.fernets[key_id] = Fernet(key.strip())
+            if self.primary is None:
+                self.primary = key_id
+        self.multi = MultiFernet(list(self.fernets.values())) if self.fernets else None
+
+    @classmethod
+    def from_env(cls):
+        spec = os.getenv("ENCRYPTION_KEYS")
+        if not spec and os.getenv("ENCRYPTION_KEY"):
+            spec = "1:" + os.getenv("ENCRYPTION_KEY")
+        ring = cls(spec or "")
+        if ring.primary is None:
+            log.warning("ENCRYPTION_KEYS not set - messages are stored unencrypted")
+        return ring
+
+
+_keyring = None
+_keyring_lock = threading.Lock()
+
+def keyring():
+    """Env se ek baar parse hoti hai (Fernet objects har call par nahi bante)."""
+    global _keyring
+    if _keyring is None:
+        with _keyring_lock:
+            if _keyring is None:
+                _keyring = KeyRing.from_env()
+    return _keyring
+
+def configured():
+    """Env mein key hai? Keys parse nahi hoti (cryptography import nahi hota) - import time checks ke liye."""
+    return bool(os.getenv("ENCRYPTION_KEYS", "").strip() or os.getenv("ENCRYPTION_KEY"))
+
+def enabled():
+    return keyring().primary is not None
+
+def current_key_id():
+    return keyring().primary
+
+
+def encrypt(text):
+    """text -> (stored value, key_id). Encryption band ho to (text, None)."""
+    ring = keyring()
+    if ring.primary is None or text is None:
+        return text, None
+    return ring.fernets[ring.primary].encrypt(text.encode()).decode(), ring.primary
+
+def encrypt_many(texts):
+    ring = keyring()
+    if ring.primary is None:
+        return [(t, None) for t in texts]
+    key_id, _encrypt = ring.primary, ring.fernets[ring.primary].encrypt
+    return [(_encrypt(t.encode()).decode(), key_id) if t is not None else (None, None) for t in texts]
+
+def decrypt(value, key_id):
+    """Stored value + key_id -> text. key_id None = plaintext row."""
+    return decrypt_many([(value, key_id)])[0]
+
+def decrypt_many(rows):
+    """[(value, key_id), ...] -> texts. Poora page ek saath, key ke hisaab se group karke."""
+    out = [value for value, _ in rows]
+    groups = {}
+    for i, (value, key_id) in enumerate(rows):
+        if key_id is not None and value is not None:
+            groups.setdefault(key_id, []).append(i)
+    if not groups:
+        return out
+    from cryptography.fernet import InvalidToken
+    fernets = keyring().fernets
+    for key_id, indexes in groups.items():
+        fernet = fernets.get(key_id)
+        failed = 0
+        for i in indexes:
+            try:
+                out[i] = fernet.decrypt(rows[i][0].encode()).decode()
+            except (AttributeError, InvalidToken, UnicodeDecodeError):   # AttributeError: key id configured nahi
+                out[i] = UNREADABLE
+                failed += 1
+        if failed:
+            log.error("Could not decrypt %s value(s) with key id %s", failed, key_id)
+    return out
 
-# Vercel Environment Variable se key uthana
-# Agar key nahi milti toh default generate hogi (testing ke liye)
-ENCRYPTION_KEY = os.getenv('ENCRYPTION_KEY', Fernet.generate_key().decode())
 
+# Purana API: koi bhi configured key chalegi (MultiFernet)
 def encrypt_message(message: str) -> bytes:
-    f = Fernet(ENCRYPTION_KEY.encode() if isinstance(ENCRYPTION_KEY, str) else ENCRYPTION_KEY)
-    return f.encrypt(message.encode())
+    ring = keyring()
+    if ring.primary is None:
+        raise RuntimeError("ENCRYPTION_KEYS not set")
+    return ring.fernets[ring.primary].encrypt(message.encode())
 
 def decrypt_message(token: bytes) -> str:
-    f = Fernet(ENCRYPTION_KEY.encode() if isinstance(ENCRYPTION_KEY, str) else ENCRYPTION_KEY)
-    return f.decrypt(token).decode()
\ No newline at end of file
+    ring = keyring()
+    if ring.multi is None:
+        raise RuntimeError("ENCRYPTION_KEYS not set")
+    return ring.multi.decrypt(token).decode()
@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import select
+import logging
+import threading
+
+log = logging.getLogger("chat.hub")
+
+# Postgres NOTIFY channel jis par naye messages announce hote hain
+CHANNEL = "chat_events"
+# NOTIFY payload ki limit 8000 bytes hai; bade broadcasts kai notifications mein
+NOTIFY_MAX_BYTES = 7000
+
+
+class Subscription:
+    """Ek waiting request ka handle. publish() hone par event set hota hai."""
+
+    def __init__(self, hub, user):
+        self.hub = hub
+        self.user = user
+        self.event = threading.Event()
+
+    def clear(self):
+        self.event.clear()
+
+    def wait(self, timeout):
+        return self.event.wait(timeout)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.hub._unsubscribe(self)
+
+
+class MemoryHub:
+    """Pure in-process fan-out hub. Tests aur single-process deployments ke liye."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subs = {}
+
+    def subscribe(self, user):
+        sub = Subscription(self, user)
+        with self._lock:
+            self._subs.setdefault(user, set()).add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            subs = self._subs.get(sub.user)
+            if subs is not None:
+                subs.discard(sub)
+                if not subs:
+                    del self._subs[sub.user]
+
+    def publish(self, *users):
+        """Is process ke waiters ko jagao. Commit ke baad call karein."""
+        with self._lock:
+            subs = [s for u in set(users) for s in self._subs.get(u, ())]
+        for sub in subs:
+            sub.event.set()
+
+    def notify_tx(self, cur, *users):
+        """Dusre processes ko announce karo (transaction ke andar). Memory hub mein no-op."""
+        pass
+
+    def invalidate_tx(self, cur, cache, key):
+        """Dusre processes ke cache se key hatao (transaction ke andar). Memory hub mein no-op."""
+        pass
+
+    def on_invalidate(self, fn, listen=False):
+        """fn(cache, key) dusre processes ki invalidations par chalega. Memory hub mein no-op."""
+        pass
+
+    def waiting(self):
+        with self._lock:
+            return sum(len(s) for s in self._subs.values())
+
+
+class PostgresHub(MemoryHub):
+    """Cross-process wakeups via Postgres LISTEN/NOTIFY.
+
+    notify_tx() transaction ke andar pg_notify karta hai, to notification
+    commit ke saath hi deliver hoti hai. Har process mein ek listener thread
+    (pehle subscriber par lazily start) notifications ko local waiters tak
+    pahunchata hai.
+    """
+
+    def __init__(self, connect):
+        super().__init__()
+        self._connect = connect
+        self._listener = None
+        self._start_lock = threading.Lock()
+        self._invalidate_handlers = []
+
+    def subscribe(self, user):
+        self._ensure_listener()
+        return super().subscribe(user)
+
+    def notify_tx(self, cur, *users):
+        chunk, size = [], 2
+        for user in sorted(set(users)):
+            item = len(json.dumps(user).encode()) + 1
+            if chunk and size + item > NOTIFY_MAX_BYTES:
+                cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps(chunk)))
+                chunk, size = [], 2
+            chunk.append(user)
+            size += item
+        if chunk:
+            cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps(chunk)))
+
+    def invalidate_tx(self, cur, cache, key):
+        cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, json.dumps({"cache": cache, "key": key})))
+
+    def on_invalidate(self, fn, listen=False):
+        """Listener (long-poll subscriber ne start kiya ho) invalidations fn tak pahunchata hai.
+        listen=True par listener yahin start - uska apna connection pool ke bahar hai."""
+        self._invalidate_handlers.append(fn)
+        if listen:
+            self._ensure_listener()
+
+    def _ensure_listener(self):
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._start_lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen_forever, name="chat-hub-listener", daemon=True)
+                self._listener.start()
+
+    def _listen_forever(self):
+        backoff = 0.5
+        while True:
+            con = None
+            try:
+                con = self._connect()
+                con.autocommit = True
+                con.cursor().execute(f"LISTEN {CHANNEL}")
+                backoff = 0.5
+                # Reconnect ke beech ki notifications miss ho sakti hain - sabko recheck karwao
+                with self._lock:
+                    users = list(self._subs)
+                self.publish(*users)
+                self._invalidate(None, None)
+                while True:
+                    if select.select([con], [], [], 30) == ([], [], []):
+                        continue
+                    con.poll()
+                    users = set()
+                    while con.notifies:
+                        note = con.notifies.pop(0)
+                        try:
+                            data = json.loads(note.payload)
+                        except ValueError:
+                            continue
+                        if isinstance(data, dict):
+                            self._invalidate(data.get("cache"), data.get("key"))
+                        else:
+                            users.update(data)
+                    if users:
+                        self.publish(*users)
+            except Exception as e:
+                log.warning("Hub listener error: %s (retry in %.1fs)", e, backoff)
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+            finally:
+                if con:
+                    try:
+                        con.close()
+                    except Exception:
+                        pass
+
+
+    def _invalidate(self, cache, key):
+        for fn in self._invalidate_handlers:
+            fn(cache, key)
+
+
+_hub = None
+_hub_lock = threading.Lock()
+
+
+def get_hub():
+    """CHAT_HUB=memory|postgres. Default: Postgres backend ho to postgres, warna memory."""
+    global _hub
+    if _hub is None:
+        with _hub_lock:
+            if _hub is None:
+                import storage
+                kind = os.getenv("CHAT_HUB") or ("postgres" if storage.get_backend().name == "postgres" else "memory")
+                _hub = PostgresHub(storage.get_connection) if kind == "postgres" else MemoryHub()
+    return _hub
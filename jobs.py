@@ -0,0 +1,356 @@
+"""Background maintenance jobs.
+
+    python jobs.py reencrypt [--batch-size 1000] [--sleep 0]
+    python jobs.py reindex   [--batch-size 1000] [--sleep 0]
+    python jobs.py compact   [--batch-size 1000] [--sleep 0]
+    python jobs.py expire    [--days N] [--batch-size 1000] [--sleep 0]
+    python jobs.py partitions
+    python jobs.py maintain  (partitions + compact + expire; /cron/maintenance yahi chalata hai)
+
+reencrypt: key rotation ke baad (ENCRYPTION_KEYS mein nayi key sabse aage)
+purani key wali - aur encryption on hone se pehle ki plaintext - messages aur
+previews ko current key se dobara encrypt karta hai. Chhote batches, har
+batch apni transaction mein, to app chalte hue bhi safe hai aur beech mein
+rokne par dobara chalana wahin se aage badhta hai. Jab kuch baaki na rahe,
+purani key ENCRYPTION_KEYS se hata sakte hain.
+
+reindex: search index (dekhein search.py) se pehle ke messages ko index
+karta hai. Encrypted messages decrypt karke index hote hain, isliye yeh SQL
+backfill nahi balki job hai. Isi tarah batches mein, dobara chalana safe.
+
+compact: dono taraf se delete hue messages (deleted_by_sender aur
+deleted_by_receiver) batches mein hatata hai - delete_conversation ab sirf
+flags lagata hai, poore table par DELETE nahi chalata.
+
+expire: MESSAGE_RETENTION_DAYS (ya --days) se purane messages. Postgres par
+poore purane partitions detach + drop hote hain (table size se independent,
+koi bloat nahi); bache hue purane rows aur unke conversation previews batches
+mein delete. MESSAGE_RETENTION_DAYS=0 (default) = hamesha rakho.
+
+partitions: Postgres par aage ke id partitions pehle se bana deta hai
+(MESSAGES_PARTITION_SIZE ids har partition, default 1000000).
+"""
+import os
+import sys
+import time
+import logging
+import argparse
+import datetime
+
+try:
+    from . import storage, crypto, search, migrations
+except (ImportError, ValueError):
+    import storage
+    import crypto
+    import search
+    import migrations
+
+log = logging.getLogger("chat.jobs")
+
+BATCH_SIZE = 1000
+RETENTION_DAYS = float(os.getenv("MESSAGE_RETENTION_DAYS", "0"))
+PARTITION_SIZE = int(os.getenv("MESSAGES_PARTITION_SIZE", str(migrations.PARTITION_SIZE)))
+# Itne partitions aage tak pehle se bane rehte hain
+PARTITIONS_AHEAD = 2
+
+
+def _update_many(cur, sql, rows):
+    if storage.get_backend().name == "postgres":
+        from psycopg2.extras import execute_batch
+        execute_batch(cur, sql, rows, page_size=500)
+    else:
+        cur.executemany(sql, rows)
+
+
+def _pause(sleep=0):
+    """Batch khatam: request scope (cron) ke andar bhi ab tak ka kaam commit ho jaaye."""
+    storage.release_connection()
+    if sleep:
+        time.sleep(sleep)
+
+
+def _out_of_time(deadline):
+    return deadline is not None and time.monotonic() >= deadline
+
+
+def _ddl_cursor():
+    """Partition DDL ke liye alag autocommit connection (pool / request transaction ke bahar).
+    Pehle scope ka kaam commit: request transaction ka messages par lock DETACH ko rok deta."""
+    storage.release_connection()
+    con = storage.get_connection()
+    con.autocommit = True
+    cur = con.cursor()
+    cur.execute(f"SET lock_timeout = '{migrations.LOCK_TIMEOUT}'")
+    return con, cur
+
+
+def _delete_messages(cur, rows):
+    """rows = [(id, sender, receiver, msg, key_id)] delete. SQLite par pehle FTS
+    index se bhi - contentless table ko wahi text chahiye jo index hua tha."""
+    ids = [row[0] for row in rows]
+    if storage.get_backend().name == "sqlite":
+        indexed = set(storage._select_in(cur, "SELECT rowid FROM messages_fts WHERE rowid IN ({})", ids))
+        rows = [row for row in rows if row[0] in indexed]
+        texts = crypto.decrypt_many([(msg, key_id) for _, _, _, msg, key_id in rows])
+        cur.executemany("INSERT INTO messages_fts (messages_fts, rowid, body, parties) VALUES ('delete', %s, %s, %s)",
+                        [(msg_id, text, search.owners(sender, receiver))
+                         for (msg_id, sender, receiver, _, _), text in zip(rows, texts) if text is not crypto.UNREADABLE])
+    for start in range(0, len(ids), storage.IN_CHUNK):
+        chunk = ids[start:start + storage.IN_CHUNK]
+        cur.execute(f"DELETE FROM messages WHERE id IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+
+def _rotate(rows):
+    """[(key, value, key_id)] -> [(new value, new key_id, key)]; jo decrypt na ho woh chhod do."""
+    texts = crypto.decrypt_many([(value, key_id) for _, value, key_id in rows])
+    keep = [(row[0], text) for row, text in zip(rows, texts) if text is not crypto.UNREADABLE]
+    encrypted = crypto.encrypt_many([text for _, text in keep])
+    return [(value, key_id, key) for (key, _), (value, key_id) in zip(keep, encrypted)], len(rows) - len(keep)
+
+
+def reencrypt(batch_size=BATCH_SIZE, sleep=0):
+    """Current key ke alawa sab kuch current key par. Counts return karta hai."""
+    if not crypto.enabled():
+        raise RuntimeError("ENCRYPTION_KEYS not set - nothing to encrypt with")
+    current = crypto.current_key_id()
+    counts = {"messages": 0, "previews": 0, "unreadable": 0}
+
+    last_id = 0
+    while True:
+        with storage.transaction() as cur:
+            cur.execute("""
+                SELECT id, msg, key_id FROM messages
+                WHERE id > %s AND (key_id IS NULL OR key_id <> %s) AND msg IS NOT NULL
+                ORDER BY id LIMIT %s
+            """, (last_id, current, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates, skipped = _rotate(rows)
+            _update_many(cur, "UPDATE messages SET msg=%s, key_id=%s WHERE id=%s", updates)
+        counts["messages"] += len(updates)
+        counts["unreadable"] += skipped
+        log.info("Re-encrypted messages up to id %s (%s so far)", last_id, counts["messages"])
+        _pause(sleep)
+
+    last = ("", "")
+    while True:
+        with storage.transaction() as cur:
+            cur.execute("""
+                SELECT owner, peer, last_preview, last_key_id, last_message_id FROM conversation_state
+                WHERE (owner, peer) > (%s, %s) AND (last_key_id IS NULL OR last_key_id <> %s)
+                  AND last_preview IS NOT NULL
+                ORDER BY owner, peer LIMIT %s
+            """, (*last, current, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last = rows[-1][:2]
+            updates, skipped = _rotate([((owner, peer, last_id), preview, key_id)
+                                        for owner, peer, preview, key_id, last_id in rows])
+            # Beech mein naya message aa gaya ho to uska (current key wala) preview mat badlo
+            _update_many(cur, """
+                UPDATE conversation_state SET last_preview=%s, last_key_id=%s
+                WHERE owner=%s AND peer=%s AND last_message_id=%s
+            """, [(value, key_id, *key) for value, key_id, key in updates])
+        counts["previews"] += len(updates)
+        counts["unreadable"] += skipped
+        _pause(sleep)
+    return counts
+
+
+def reindex(batch_size=BATCH_SIZE, sleep=0):
+    """Jo messages search index mein nahi hain unhe index karo. Count return karta hai."""
+    if not search.MESSAGE_SEARCH:
+        raise RuntimeError("MESSAGE_SEARCH is off - nothing to index")
+    postgres = storage.get_backend().name == "postgres"
+    if postgres:
+        missing = "m.search IS NULL"
+    else:
+        missing = "NOT EXISTS (SELECT 1 FROM messages_fts f WHERE f.rowid = m.id)"
+    total = last_id = 0
+    while True:
+        with storage.transaction() as cur:
+            cur.execute(f"""
+                SELECT m.id, m.sender, m.receiver, m.msg, m.key_id FROM messages m
+                WHERE m.id > %s AND m.msg IS NOT NULL AND {missing}
+                ORDER BY m.id LIMIT %s
+            """, (last_id, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            texts = crypto.decrypt_many([(msg, key_id) for _, _, _, msg, key_id in rows])
+            docs = [(msg_id, *search.document(sender, receiver, text))
+                    for (msg_id, sender, receiver, _, _), text in zip(rows, texts) if text is not crypto.UNREADABLE]
+            if postgres:
+                _update_many(cur, f"UPDATE messages SET search = {storage._SEARCH_VECTOR} WHERE id=%s",
+                             [(text, owners, msg_id) for msg_id, text, owners in docs])
+            else:
+                storage._index_fts(cur, docs)
+        total += len(docs)
+        log.info("Indexed messages up to id %s (%s so far)", last_id, total)
+        _pause(sleep)
+    return total
+
+
+def compact(batch_size=BATCH_SIZE, sleep=0, deadline=None):
+    """Dono users ke delete kiye messages hatao (messages_deleted_idx partial index se). Count return."""
+    total = 0
+    while not _out_of_time(deadline):
+        with storage.transaction() as cur:
+            cur.execute("""
+                SELECT id, sender, receiver, msg, key_id FROM messages
+                WHERE deleted_by_sender=1 AND deleted_by_receiver=1
+                ORDER BY id LIMIT %s
+            """, (batch_size,))
+            rows = cur.fetchall()
+            if rows:
+                _delete_messages(cur, rows)
+        if not rows:
+            storage.release_connection()
+            break
+        total += len(rows)
+        log.info("Compacted %s deleted message(s)", total)
+        _pause(sleep)
+    return total
+
+
+def partitions(size=PARTITION_SIZE, ahead=PARTITIONS_AHEAD):
+    """Postgres: aage ke partitions bana do. Naye partitions ke naam."""
+    if storage.get_backend().name != "postgres":
+        return []
+    con, cur = _ddl_cursor()
+    try:
+        created = migrations.ensure_message_partitions(cur, size, ahead)
+    finally:
+        con.close()
+    for name in created:
+        log.info("Created partition %s", name)
+    return created
+
+
+def _drop_expired_partitions(cutoff):
+    """Jin partitions ka sabse naya message bhi cutoff se purana hai unhe detach + drop.
+    Sirf bhare hue partitions (upper bound sequence se neeche), id order mein."""
+    con, cur = _ddl_cursor()
+    dropped = []
+    try:
+        cur.execute("SELECT last_value FROM messages_id_seq")
+        current = cur.fetchone()[0]
+        for name, _, hi in migrations.message_partitions(cur):
+            if hi > current:
+                break
+            cur.execute(f"SELECT timestamp FROM {name} ORDER BY id DESC LIMIT 1")
+            row = cur.fetchone()
+            if row is not None and (row[0] is None or row[0] >= cutoff):
+                break
+            # Default partition ho to CONCURRENTLY nahi chalta; lock sirf metadata change tak
+            cur.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+            cur.execute(f"DROP TABLE {name}")
+            dropped.append(name)
+            log.info("Dropped expired partition %s", name)
+    finally:
+        con.close()
+    return dropped
+
+
+def expire(days=RETENTION_DAYS, batch_size=BATCH_SIZE, sleep=0, deadline=None):
+    """days se purane messages aur previews hatao. Counts return karta hai."""
+    if not days or days <= 0:
+        raise RuntimeError("Retention not configured - set MESSAGE_RETENTION_DAYS or pass --days")
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=days)
+    counts = {"partitions": [], "messages": 0, "conversations": 0}
+    if storage.get_backend().name == "postgres":
+        counts["partitions"] = _drop_expired_partitions(cutoff)
+
+    # Bache hue purane rows: ids waqt ke saath badhti hain, to shuru se tab tak jab tak naye na milein
+    last_id = 0
+    while not _out_of_time(deadline):
+        with storage.transaction() as cur:
+            cur.execute("""
+                SELECT id, sender, receiver, msg, key_id, timestamp FROM messages
+                WHERE id > %s ORDER BY id LIMIT %s
+            """, (last_id, batch_size))
+            rows = cur.fetchall()
+            old = [row[:5] for row in rows if row[5] is not None and row[5] < cutoff]
+            if old:
+                _delete_messages(cur, old)
+        counts["messages"] += len(old)
+        if not rows or any(row[5] is not None and row[5] >= cutoff for row in rows):
+            storage.release_connection()
+            break
+        last_id = rows[-1][0]
+        _pause(sleep)
+
+    # Jin conversations ka aakhri message bhi expire ho gaya, unka preview bhi
+    while not _out_of_time(deadline):
+        with storage.transaction() as cur:
+            cur.execute("""
+                DELETE FROM conversation_state WHERE (owner, peer) IN (
+                    SELECT owner, peer FROM conversation_state WHERE last_at < %s LIMIT %s
+                )
+            """, (cutoff, batch_size))
+            deleted = cur.rowcount
+        counts["conversations"] += deleted
+        _pause(sleep)
+        if deleted < batch_size:
+            break
+    log.info("Expired %s message(s) and %s conversation(s) older than %s",
+             counts["messages"], counts["conversations"], cutoff)
+    return counts
+
+
+def maintain(batch_size=BATCH_SIZE, retention_days=RETENTION_DAYS, time_budget=None):
+    """Cron ka kaam: partitions, compact, aur retention set ho to expire.
+    time_budget (seconds) ke baad batches ruk jaate hain - baaki agli baar."""
+    deadline = time.monotonic() + time_budget if time_budget else None
+    result = {"partitions": partitions(), "compacted": compact(batch_size, deadline=deadline)}
+    if retention_days:
+        result["expired"] = expire(retention_days, batch_size, deadline=deadline)
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Chat app maintenance jobs")
+    sub = parser.add_subparsers(dest="job", required=True)
+    p = sub.add_parser("reencrypt", help="purani key / plaintext data ko current key par le aao")
+    p.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    p.add_argument("--sleep", type=float, default=0, help="har batch ke baad itne seconds ruko (load kam)")
+    p = sub.add_parser("reindex", help="purane messages ko search index mein daalo")
+    p.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    p.add_argument("--sleep", type=float, default=0, help="har batch ke baad itne seconds ruko (load kam)")
+    p = sub.add_parser("compact", help="dono taraf se deleted messages hatao")
+    p.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    p.add_argument("--sleep", type=float, default=0, help="har batch ke baad itne seconds ruko (load kam)")
+    p = sub.add_parser("expire", help="retention se purane messages hatao")
+    p.add_argument("--days", type=float, default=RETENTION_DAYS)
+    p.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    p.add_argument("--sleep", type=float, default=0, help="har batch ke baad itne seconds ruko (load kam)")
+    sub.add_parser("partitions", help="aage ke message partitions banao (Postgres)")
+    sub.add_parser("maintain", help="partitions + compact + expire (cron)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    if args.job == "reencrypt":
+        counts = reencrypt(args.batch_size, args.sleep)
+        print(f"Re-encrypted {counts['messages']} message(s) and {counts['previews']} preview(s); "
+              f"{counts['unreadable']} could not be decrypted and were left as is.")
+    elif args.job == "reindex":
+        print(f"Indexed {reindex(args.batch_size, args.sleep)} message(s) for search.")
+    elif args.job == "compact":
+        print(f"Removed {compact(args.batch_size, args.sleep)} message(s) deleted by both users.")
+    elif args.job == "expire":
+        counts = expire(args.days, args.batch_size, args.sleep)
+        print(f"Dropped {len(counts['partitions'])} partition(s), removed {counts['messages']} message(s) "
+              f"and {counts['conversations']} conversation preview(s).")
+    elif args.job == "partitions":
+        print(f"Created {len(partitions())} partition(s).")
+    elif args.job == "maintain":
+        print(maintain())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
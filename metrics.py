@@ -0,0 +1,324 @@
+"""Request instrumentation: queries, connections, rows aur phase timings.
+
+Har request ka ek RequestStats contextvar mein rehta hai. backends ke cursors
+aur pool usme likhte hain (connect / execute / fetch), storage commit time
+karta hai, app ka JSON provider serialize, aur storage ke public functions
+@instrument se time hote hain. Hot path par koi lock nahi - request khatam
+hone par sab ek baar process-wide registry mein jaata hai.
+
+  /metrics                 Prometheus text format (process ke totals); METRICS_TOKEN
+                           set ho tabhi, "Authorization: Bearer <token>" ke saath
+  SERVER_TIMING=1          har response par Server-Timing header
+  SLOW_QUERY_MS=200        isse dheemi query "chat.sql" logger par warning
+"""
+import os
+import re
+import time
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from functools import wraps
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SERVER_TIMING = os.getenv("SERVER_TIMING", "").lower() in ("1", "true", "yes", "on")
+
+PHASES = ("bootstrap", "connect", "execute", "fetch", "commit", "crypto", "serialize")
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+# Request ke bahar (migrations, jobs, bench seeding) ka kaam is endpoint label par
+NO_REQUEST = "-"
+
+slow_log = logging.getLogger("chat.sql")
+startup_log = logging.getLogger("chat.startup")
+
+
+# ---------------- REGISTRY ----------------
+class Metric:
+    """Labelled counter / histogram. Label values ek tuple key banti hain."""
+
+    def __init__(self, kind, name, help, labels=(), buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self.values = {}
+
+    def inc(self, key, value=1):
+        self.values[key] = self.values.get(key, 0) + value
+
+    def observe(self, key, value):
+        entry = self.values.get(key)
+        if entry is None:
+            entry = self.values[key] = [[0] * len(self.buckets), 0, 0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                entry[0][i] += 1
+        entry[1] += 1
+        entry[2] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.values.items()):
+            labels = [f'{name}="{_escape(v)}"' for name, v in zip(self.labels, key)]
+            if self.kind == "counter":
+                lines.append(f"{self.name}{_labels(labels)} {_number(value)}")
+                continue
+            buckets, count, total = value
+            for bound, n in zip(self.buckets + ("+Inf",), buckets + [count]):
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(labels + [le])} {n}")
+            lines.append(f"{self.name}_count{_labels(labels)} {count}")
+            lines.append(f"{self.name}_sum{_labels(labels)} {_number(total)}")
+        return lines
+
+
+def _labels(labels):
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+        self.gauges = []
+
+    def counter(self, name, help, labels=()):
+        metric = Metric("counter", name, help, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Metric("histogram", name, help, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name, help, fn, kind="gauge", labels=()):
+        """fn() scrape ke time call hota hai (pool size, waiting long-polls...).
+        labels diye hon to fn() {label values tuple: value} return kare."""
+        self.gauges.append((name, help, fn, kind, labels))
+
+    def render(self):
+        with self.lock:
+            lines = [line for metric in self.metrics for line in metric.render()]
+        for name, help, fn, kind, labels in self.gauges:
+            try:
+                value = fn()
+            except Exception:
+                continue
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+            if not labels:
+                lines.append(f"{name} {_number(value)}")
+                continue
+            for key, v in sorted(value.items()):
+                pairs = [f'{label}="{_escape(k)}"' for label, k in zip(labels, key)]
+                lines.append(f"{name}{_labels(pairs)} {_number(v)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+requests_total = registry.counter("chat_requests_total", "HTTP requests.", ("endpoint", "method", "status"))
+request_seconds = registry.histogram("chat_request_duration_seconds", "HTTP request latency.", ("endpoint",))
+queries_total = registry.counter("chat_db_queries_total", "SQL statements executed.", ("endpoint",))
+queries_per_request = registry.histogram("chat_db_queries_per_request", "SQL statements per request (N+1 detector).",
+                                         ("endpoint",), COUNT_BUCKETS)
+rows_total = registry.counter("chat_db_rows_total", "Rows fetched from the database.", ("endpoint",))
+connections_total = registry.counter("chat_db_connections_total",
+                                     "Pool checkouts; opened=1 means a new database connection.", ("endpoint", "opened"))
+phase_seconds = registry.counter("chat_phase_seconds_total", "Time spent per request phase.", ("endpoint", "phase"))
+storage_seconds = registry.histogram("chat_storage_call_duration_seconds", "storage.py call latency.", ("call",))
+slow_queries_total = registry.counter("chat_db_slow_queries_total", "Queries slower than SLOW_QUERY_MS.", ("endpoint",))
+
+
+# ---------------- PER-REQUEST STATS ----------------
+class RequestStats:
+    __slots__ = ("endpoint", "method", "started", "queries", "rows", "checkouts", "opened", "phases", "calls")
+
+    def __init__(self, endpoint=NO_REQUEST, method=""):
+        self.endpoint = endpoint
+        self.method = method
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.rows = 0
+        self.checkouts = 0
+        self.opened = 0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.calls = []   # (storage function, seconds)
+
+    def flush(self):
+        """Process-wide registry mein daalo (ek lock, ek baar)."""
+        key = (self.endpoint,)
+        with registry.lock:
+            queries_total.inc(key, self.queries)
+            rows_total.inc(key, self.rows)
+            if self.checkouts - self.opened:
+                connections_total.inc((self.endpoint, "0"), self.checkouts - self.opened)
+            if self.opened:
+                connections_total.inc((self.endpoint, "1"), self.opened)
+            for phase, seconds in self.phases.items():
+                if seconds:
+                    phase_seconds.inc((self.endpoint, phase), seconds)
+            for call, seconds in self.calls:
+                storage_seconds.observe((call,), seconds)
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+@contextmanager
+def _stats():
+    """Current request ke stats; request ke bahar ek throwaway jo turant flush hota hai."""
+    stats = _current.get()
+    if stats is not None:
+        yield stats
+    else:
+        stats = RequestStats()
+        yield stats
+        stats.flush()
+
+
+def begin_request(endpoint, method):
+    _current.set(RequestStats(endpoint or "unmatched", method))
+
+
+def end_request(response=None):
+    """Request ke stats registry mein daalo aur (SERVER_TIMING par) header lagao. Dobara call safe hai."""
+    stats = _current.get()
+    if stats is None:
+        return
+    _current.set(None)
+    total = time.perf_counter() - stats.started
+    status = str(response.status_code) if response is not None else "500"
+    stats.flush()
+    with registry.lock:
+        requests_total.inc((stats.endpoint, stats.method, status))
+        request_seconds.observe((stats.endpoint,), total)
+        queries_per_request.observe((stats.endpoint,), stats.queries)
+    if SERVER_TIMING and response is not None:
+        response.headers["Server-Timing"] = server_timing(stats, total)
+
+
+def server_timing(stats, total):
+    p = stats.phases
+    parts = [f'db;dur={(p["connect"] + p["execute"] + p["fetch"] + p["commit"]) * 1000:.2f};'
+             f'desc="{stats.queries} queries, {stats.rows} rows, {stats.opened} new conn"']
+    parts += [f"{phase};dur={p[phase] * 1000:.2f}" for phase in PHASES if p[phase]]
+    parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+# ---------------- HOOKS ----------------
+_WS = re.compile(r"\s+")
+
+def record_query(sql, seconds):
+    with _stats() as stats:
+        stats.queries += 1
+        stats.phases["execute"] += seconds
+        endpoint = stats.endpoint
+    if seconds * 1000 >= SLOW_QUERY_MS:
+        with registry.lock:
+            slow_queries_total.inc((endpoint,))
+        slow_log.warning("slow query %.1fms [%s]: %s", seconds * 1000, endpoint, _WS.sub(" ", str(sql)).strip()[:500])
+
+
+def record_fetch(rows, seconds):
+    with _stats() as stats:
+        stats.rows += rows
+        stats.phases["fetch"] += seconds
+
+
+def record_checkout(seconds, opened):
+    with _stats() as stats:
+        stats.checkouts += 1
+        stats.opened += opened
+        stats.phases["connect"] += seconds
+
+
+@contextmanager
+def phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stats = _current.get()
+        if stats is not None:
+            stats.phases[name] += time.perf_counter() - started
+
+
+def instrument(fn):
+    """storage function ka har call time karo (chat_storage_call_duration_seconds)."""
+    name = fn.__name__
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - started
+            stats = _current.get()
+            if stats is not None:
+                stats.calls.append((name, seconds))
+            else:
+                with registry.lock:
+                    storage_seconds.observe((name,), seconds)
+    return wrapper
+
+
+class InstrumentedCursor:
+    """DB-API cursor mixin: execute aur fetch ko time/count karta hai."""
+
+    def execute(self, sql, params=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql) if params is None else super().execute(sql, params)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq)
+        finally:
+            record_query(sql, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        record_fetch(0 if row is None else 1, time.perf_counter() - started)
+        return row
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        rows = super().fetchmany(*args)
+        record_fetch(len(rows), time.perf_counter() - started)
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = super().fetchall()
+        record_fetch(len(rows), time.perf_counter() - started)
+        return rows
+
+
+# Cold start ke stages (app import, pehli request ka schema check) -> seconds
+STARTUP = {}
+
+def record_startup(stage, seconds):
+    STARTUP[stage] = seconds
+    startup_log.info("%s took %.1fms", stage, seconds * 1000)
+
+
+def query_total():
+    """Process mein ab tak ki saari queries (bench.py queries/request ke liye)."""
+    with registry.lock:
+        return sum(queries_total.values.values())
@@ -0,0 +1,708 @@
+"""Versioned schema migrations (Postgres aur SQLite backends ke liye).
+
+Har migration ek baar chalti hai aur schema_migrations table mein record hoti
+hai. Steps populated database par online chalne ke liye likhe gaye hain:
+column add sirf metadata change hai, backfill chhote batches mein commit hota
+hai, aur indexes CREATE INDEX CONCURRENTLY se bante hain. Har step idempotent
+hai, to beech mein fail hui migration dobara chalayi ja sakti hai.
+
+Deploy par chalayein:  python migrations.py
+"""
+import re
+import sys
+import time
+import logging
+
+try:
+    from . import storage
+except (ImportError, ValueError):
+    import storage
+
+log = logging.getLogger("chat.migrations")
+
+# pg_advisory_lock key - do instances ek saath migrate na karein
+LOCK_KEY = 0x63686174  # "chat"
+BATCH_SIZE = 5000
+# DDL lambi transactions ke peeche queue hokar saari traffic block na kare
+LOCK_TIMEOUT = "5s"
+# messages partition ka size (ids). Migration ke liye frozen; aage ke partitions jobs.py banata hai.
+PARTITION_SIZE = 1000000
+
+
+# ---------------- HELPERS ----------------
+def _exists(cur, sql, params=()):
+    cur.execute(sql, params)
+    return cur.fetchone() is not None
+
+def _has_constraint(cur, table, name):
+    return _exists(cur, """
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = to_regclass(%s) AND conname=%s
+    """, (table, name))
+
+def _has_primary_key(cur, table):
+    return _exists(cur, "SELECT 1 FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype='p'", (table,))
+
+def _create_index(cur, name, definition):
+    """CREATE INDEX CONCURRENTLY, pichhli fail hui koshish ka INVALID index hata kar."""
+    cur.execute("""
+        SELECT i.indisvalid FROM pg_class c JOIN pg_index i ON i.indexrelid = c.oid
+        WHERE c.relname=%s AND c.relnamespace = current_schema()::regnamespace
+    """, (name,))
+    row = cur.fetchone()
+    if row and row[0]:
+        return
+    if row:
+        cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+    cur.execute(f"CREATE {definition.replace('INDEX', f'INDEX CONCURRENTLY {name}', 1)}")
+
+def _set_not_null(cur, table, column):
+    """SET NOT NULL bina lambe ACCESS EXCLUSIVE scan ke: pehle NOT VALID check
+    constraint, phir VALIDATE (sirf SHARE UPDATE EXCLUSIVE lock), phir Postgres
+    us validated constraint se scan skip kar deta hai."""
+    check = f"{table}_{column}_not_null"
+    if not _has_constraint(cur, table, check):
+        cur.execute(f"ALTER TABLE {table} ADD CONSTRAINT {check} CHECK ({column} IS NOT NULL) NOT VALID")
+    cur.execute(f"ALTER TABLE {table} VALIDATE CONSTRAINT {check}")
+    cur.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET NOT NULL")
+    cur.execute(f"ALTER TABLE {table} DROP CONSTRAINT {check}")
+
+def _is_partitioned(cur, table):
+    return _exists(cur, "SELECT 1 FROM pg_class WHERE oid = to_regclass(%s) AND relkind = 'p'", (table,))
+
+_BOUND = re.compile(r"FOR VALUES FROM \((?:MINVALUE|'?(-?\d+)'?)\) TO \('?(-?\d+)'?\)")
+
+def message_partitions(cur):
+    """messages ke range partitions [(name, lo, hi)], id order mein. lo None = MINVALUE."""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+    """)
+    parts = []
+    for name, bound in cur.fetchall():
+        m = _BOUND.match(bound)
+        if m:
+            parts.append((name, int(m.group(1)) if m.group(1) else None, int(m.group(2))))
+    return sorted(parts, key=lambda p: p[2])
+
+def add_message_partition(cur, lo, hi):
+    """messages ka [lo, hi) partition. CREATE TABLE ... PARTITION OF parent par ACCESS
+    EXCLUSIVE lock leta hai; alag table + CHECK + ATTACH sirf SHARE UPDATE EXCLUSIVE,
+    to reads/writes chalte rehte hain."""
+    name = f"messages_p{int(lo)}"
+    if _exists(cur, "SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(%s)", (name,)):
+        return name
+    cur.execute(f"CREATE TABLE IF NOT EXISTS {name} (LIKE messages INCLUDING DEFAULTS)")
+    if not _has_constraint(cur, name, f"{name}_range"):
+        cur.execute(f"ALTER TABLE {name} ADD CONSTRAINT {name}_range CHECK (id >= {int(lo)} AND id < {int(hi)})")
+    cur.execute(f"ALTER TABLE messages ATTACH PARTITION {name} FOR VALUES FROM ({int(lo)}) TO ({int(hi)})")
+    cur.execute(f"ALTER TABLE {name} DROP CONSTRAINT {name}_range")
+    return name
+
+def ensure_message_partitions(cur, size=PARTITION_SIZE, ahead=2):
+    """Sequence se `ahead` partitions aage tak ke partitions bana do; naye partitions ke naam.
+    Default partition mein rows aa gayi hon (partitions waqt par nahi bane) to naya
+    partition unke upar se shuru hota hai - woh rows default mein hi rehti hain."""
+    if not _is_partitioned(cur, "messages"):
+        return []
+    parts = message_partitions(cur)
+    top = parts[-1][2] if parts else 0
+    if _exists(cur, "SELECT 1 WHERE to_regclass('messages_default') IS NOT NULL"):
+        cur.execute("SELECT COALESCE(MAX(id) + 1, 0) FROM messages_default")
+        top = max(top, cur.fetchone()[0])
+    cur.execute("SELECT last_value FROM messages_id_seq")
+    target = cur.fetchone()[0] + ahead * size
+    created = []
+    while top < target:
+        created.append(add_message_partition(cur, top, top + size))
+        top += size
+    return created
+
+def _batched(con, sql, params=()):
+    """sql ko tab tak chalao jab tak rows update hoti rahein; har batch alag commit."""
+    total = 0
+    while True:
+        with con:
+            with con.cursor() as cur:
+                cur.execute(sql, params)
+                count = cur.rowcount
+        total += count
+        if count < BATCH_SIZE:
+            return total
+
+
+# ---------------- MIGRATIONS ----------------
+def m001_base_tables(con, cur):
+    # Purana init_db wala schema, naye database ke liye
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        email TEXT UNIQUE,
+        password TEXT
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        sender TEXT,
+        receiver TEXT,
+        msg TEXT,
+        is_read INTEGER DEFAULT 0,
+        timestamp TIMESTAMP,
+        deleted_by_sender INTEGER DEFAULT 0,
+        deleted_by_receiver INTEGER DEFAULT 0
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS blocks (
+        blocker TEXT,
+        blocked TEXT
+    )
+    """)
+
+def m002_message_ids(con, cur):
+    """messages.id surrogate primary key.
+
+    Naye rows ko turant sequence se id milti hai. Purane rows ko timestamp
+    order mein chhoti ids di jaati hain (1..N), isliye main sequence ko table
+    ke maximum possible row count ke upar se start kiya jaata hai - inbox
+    cursors ke liye id order hamesha message order rahe.
+    """
+    if _has_primary_key(cur, "messages"):
+        return
+    with con:
+        # Ek chhoti transaction: column + default. Lock sirf metadata change tak.
+        cur.execute("CREATE SEQUENCE IF NOT EXISTS messages_id_seq")
+        cur.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS id BIGINT")
+        cur.execute("""
+            SELECT pg_get_expr(d.adbin, d.adrelid) FROM pg_attrdef d
+            JOIN pg_attribute a ON a.attrelid = d.adrelid AND a.attnum = d.adnum
+            WHERE d.adrelid = 'messages'::regclass AND a.attname = 'id'
+        """)
+        if cur.fetchone() is None:
+            # Heap page mein max 291 tuples - isse zyada purane rows ho hi nahi sakte
+            cur.execute("""
+                SELECT setval('messages_id_seq',
+                    (pg_relation_size('messages') / current_setting('block_size')::BIGINT + 1) * 291 + 1, false)
+            """)
+            cur.execute("ALTER TABLE messages ALTER COLUMN id SET DEFAULT nextval('messages_id_seq')")
+        cur.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+
+    # Purane rows: timestamp order ek baar nikaal lo, phir batches mein likho.
+    # messages_backfill_seq yaad rakhta hai kahan tak likha gaya (rerun ke liye).
+    cur.execute("CREATE SEQUENCE IF NOT EXISTS messages_backfill_seq MINVALUE 0 START 0")
+    cur.execute("SELECT last_value FROM messages_backfill_seq")
+    offset = cur.fetchone()[0]
+    cur.execute("DROP TABLE IF EXISTS pg_temp.messages_backfill")
+    cur.execute("""
+        CREATE TEMP TABLE messages_backfill AS
+        SELECT ctid AS tid, %s + row_number() OVER (ORDER BY timestamp NULLS FIRST, ctid) AS new_id
+        FROM messages WHERE id IS NULL
+    """, (offset,))
+    cur.execute("CREATE INDEX ON messages_backfill (new_id)")
+    cur.execute("SELECT COALESCE(MIN(new_id), 0), COALESCE(MAX(new_id), -1) FROM messages_backfill")
+    lo, hi = cur.fetchone()
+    for start in range(lo, hi + 1, BATCH_SIZE):
+        with con:
+            cur.execute("""
+                UPDATE messages m SET id = b.new_id FROM messages_backfill b
+                WHERE b.new_id >= %s AND b.new_id < %s AND m.ctid = b.tid AND m.id IS NULL
+            """, (start, start + BATCH_SIZE))
+            cur.execute("SELECT setval('messages_backfill_seq', %s)", (min(start + BATCH_SIZE - 1, hi),))
+    # Beech mein update hue rows ka ctid badal gaya hoga - unhe bhi id do
+    _batched(con, f"""
+        UPDATE messages SET id = nextval('messages_backfill_seq')
+        WHERE ctid = ANY(ARRAY(SELECT ctid FROM messages WHERE id IS NULL LIMIT {BATCH_SIZE}))
+    """)
+    cur.execute("DROP TABLE pg_temp.messages_backfill")
+    cur.execute("DROP SEQUENCE messages_backfill_seq")
+
+    _create_index(cur, "messages_pkey", "UNIQUE INDEX ON messages (id)")
+    _set_not_null(cur, "messages", "id")
+    cur.execute("ALTER TABLE messages ADD CONSTRAINT messages_pkey PRIMARY KEY USING INDEX messages_pkey")
+
+def m003_conversation_key(con, cur):
+    """user_lo/user_hi: conversation ki canonical key (LEAST/GREATEST of the pair,
+    "C" collation mein taaki Python ke string order se match kare).
+    Trigger har writer ke liye key set karta hai, purane rows batches mein backfill."""
+    cur.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS user_lo TEXT")
+    cur.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS user_hi TEXT")
+    cur.execute("""
+        CREATE OR REPLACE FUNCTION messages_conversation_key() RETURNS trigger AS $$
+        BEGIN
+            NEW.user_lo := LEAST(NEW.sender COLLATE "C", NEW.receiver COLLATE "C");
+            NEW.user_hi := GREATEST(NEW.sender COLLATE "C", NEW.receiver COLLATE "C");
+            RETURN NEW;
+        END $$ LANGUAGE plpgsql
+    """)
+    cur.execute("DROP TRIGGER IF EXISTS messages_conversation_key ON messages")
+    cur.execute("""
+        CREATE TRIGGER messages_conversation_key
+        BEFORE INSERT OR UPDATE OF sender, receiver ON messages
+        FOR EACH ROW EXECUTE FUNCTION messages_conversation_key()
+    """)
+    cur.execute("SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), -1) FROM messages WHERE user_lo IS NULL")
+    lo, hi = cur.fetchone()
+    for start in range(lo, hi + 1, BATCH_SIZE):
+        with con:
+            cur.execute("""
+                UPDATE messages SET user_lo = LEAST(sender COLLATE "C", receiver COLLATE "C"),
+                                    user_hi = GREATEST(sender COLLATE "C", receiver COLLATE "C")
+                WHERE id >= %s AND id < %s AND user_lo IS NULL
+            """, (start, start + BATCH_SIZE))
+
+def m004_message_indexes(con, cur):
+    # Inbox pages / deltas: (conversation, id)
+    _create_index(cur, "messages_conversation_idx", "INDEX ON messages (user_lo, user_hi, id)")
+    # Unread counts aur mark-as-read
+    _create_index(cur, "messages_unread_idx", "INDEX ON messages (receiver, sender, is_read)")
+    # Conversation list: user ke bheje hue messages (received wale upar ke index se)
+    _create_index(cur, "messages_sender_idx", "INDEX ON messages (sender, id)")
+
+def m005_blocks_primary_key(con, cur):
+    if _has_primary_key(cur, "blocks"):
+        return
+    with con:
+        cur.execute("DELETE FROM blocks WHERE blocker IS NULL OR blocked IS NULL")
+        cur.execute("""
+            DELETE FROM blocks a USING blocks b
+            WHERE a.blocker = b.blocker AND a.blocked = b.blocked AND a.ctid > b.ctid
+        """)
+    _create_index(cur, "blocks_pkey", "UNIQUE INDEX ON blocks (blocker, blocked)")
+    _set_not_null(cur, "blocks", "blocker")
+    _set_not_null(cur, "blocks", "blocked")
+    cur.execute("ALTER TABLE blocks ADD CONSTRAINT blocks_pkey PRIMARY KEY USING INDEX blocks_pkey")
+
+_STATE_TABLE = """
+    CREATE TABLE IF NOT EXISTS conversation_state (
+        owner TEXT NOT NULL,
+        peer TEXT NOT NULL,
+        last_message_id BIGINT NOT NULL DEFAULT 0,
+        last_sender TEXT,
+        last_preview TEXT,
+        last_at TIMESTAMP,
+        unread INTEGER NOT NULL DEFAULT 0,
+        read_upto BIGINT NOT NULL DEFAULT 0,
+        cleared_upto BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (owner, peer)
+    )
+"""
+_STATE_INDEX = """
+    CREATE INDEX IF NOT EXISTS conversation_state_recent_idx
+    ON conversation_state (owner, last_message_id DESC)
+"""
+# 100 = storage.PREVIEW_LENGTH (migration frozen rehni chahiye).
+# {where}: kin messages se (poora table, ya ek conversation).
+_STATE_COLUMNS = "(owner, peer, last_message_id, last_sender, last_preview, last_at, unread, read_upto, cleared_upto)"
+_STATE_AGGREGATE = """
+    SELECT s.owner, s.peer, s.last_id, m.sender, SUBSTR(m.msg, 1, 100), m.timestamp,
+           s.unread, s.read_upto, s.cleared_upto
+    FROM (
+        SELECT owner, peer, MAX(id) AS last_id,
+               COUNT(*) FILTER (WHERE incoming AND is_read=0 AND NOT deleted) AS unread,
+               COALESCE(MAX(id) FILTER (WHERE incoming AND is_read=1), 0) AS read_upto,
+               COALESCE(MAX(id) FILTER (WHERE deleted), 0) AS cleared_upto
+        FROM (
+            SELECT sender AS owner, receiver AS peer, id, FALSE AS incoming, is_read,
+                   deleted_by_sender=1 AS deleted
+            FROM messages WHERE {where}
+            UNION ALL
+            SELECT receiver, sender, id, TRUE, is_read, deleted_by_receiver=1
+            FROM messages WHERE receiver <> sender AND {where}
+        ) x
+        GROUP BY owner, peer
+    ) s
+    JOIN messages m ON m.id = s.last_id
+"""
+# "WHERE TRUE" SQLite ke INSERT ... SELECT ... ON CONFLICT parser ke liye.
+_STATE_BACKFILL = f"""
+    INSERT INTO conversation_state {_STATE_COLUMNS}
+    {_STATE_AGGREGATE.format(where="TRUE")}
+    WHERE TRUE
+    ON CONFLICT (owner, peer) DO NOTHING
+"""
+# Postgres: wahi backfill, aur jin rows ko naye code ne beech mein bana diya (conflict) unki conversations
+_STATE_BACKFILL_CONFLICTS = f"""
+    WITH agg AS ({_STATE_AGGREGATE.format(where="TRUE")}),
+    ins AS (
+        INSERT INTO conversation_state {_STATE_COLUMNS}
+        SELECT * FROM agg
+        ON CONFLICT (owner, peer) DO NOTHING
+        RETURNING owner, peer
+    )
+    SELECT DISTINCT LEAST(owner COLLATE "C", peer COLLATE "C"), GREATEST(owner COLLATE "C", peer COLLATE "C")
+    FROM (SELECT owner, peer FROM agg EXCEPT SELECT owner, peer FROM ins) c
+"""
+# Ek conversation ki rows messages se dobara. read_upto / cleared_upto watermarks
+# aage hi badhte hain, aur unread merged read_upto ke baad ke messages se ginte hain.
+_STATE_RECONCILE = f"""
+    INSERT INTO conversation_state AS st {_STATE_COLUMNS}
+    {_STATE_AGGREGATE.format(where="user_lo=%(lo)s AND user_hi=%(hi)s")}
+    ON CONFLICT (owner, peer) DO UPDATE SET
+        last_message_id = EXCLUDED.last_message_id,
+        last_sender = EXCLUDED.last_sender,
+        last_preview = EXCLUDED.last_preview,
+        last_at = EXCLUDED.last_at,
+        read_upto = GREATEST(st.read_upto, EXCLUDED.read_upto),
+        cleared_upto = GREATEST(st.cleared_upto, EXCLUDED.cleared_upto),
+        unread = CASE WHEN st.owner = st.peer THEN 0 ELSE (
+            SELECT COUNT(*) FROM messages
+            WHERE user_lo=%(lo)s AND user_hi=%(hi)s AND sender = st.peer AND receiver = st.owner
+              AND id > GREATEST(st.read_upto, EXCLUDED.read_upto) AND is_read=0 AND deleted_by_receiver=0
+        ) END
+"""
+
+def m006_conversation_state(con, cur):
+    """Har (owner, peer) ke liye ek row: last message, unread counter, read aur
+    clear watermarks. Summary / unread count ab primary-key lookup hain.
+
+    Backfill ek read-only pass hai (messages par writes block nahi hote), to
+    uske dauraan do tarah ke writes chhoot sakte hain: naya code jo pehle hi
+    apni row upsert kar chuka (backfill usse conflict par chhod deta hai) aur
+    purane instances ke messages jo snapshot ke baad commit hue. Dono ki
+    conversations baad mein messages se dobara banti hain, storage wale
+    conversation lock ke andar (naye writers us waqt ruk jaate hain). Reconcile
+    ke baad purane instances ke writes ka unread agle mark_read par theek hota hai.
+    """
+    cur.execute(_STATE_TABLE)
+    cur.execute(_STATE_INDEX)
+    # Chalti write transactions khatam hone do: iske baad commit hone wala har message id > since
+    with con:
+        cur.execute("LOCK TABLE messages IN SHARE MODE")
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM messages")
+        since = cur.fetchone()[0]
+    with con:
+        cur.execute(_STATE_BACKFILL_CONFLICTS)
+        pairs = set(cur.fetchall())
+    cur.execute("SELECT DISTINCT user_lo, user_hi FROM messages WHERE id > %s", (since,))
+    pairs.update(cur.fetchall())
+    pairs = sorted(pairs)
+    for start in range(0, len(pairs), 100):
+        chunk = pairs[start:start + 100]
+        with con:
+            storage._lock_conversations(cur, chunk)
+            for lo, hi in chunk:
+                cur.execute(_STATE_RECONCILE, {"lo": lo, "hi": hi})
+    if pairs:
+        log.info("Reconciled conversation state for %s conversation(s) written during backfill", len(pairs))
+
+def m007_encryption_key_ids(con, cur):
+    """Encrypted rows ki key version (NULL = plaintext). Nullable bina default
+    ke column add karna sirf catalog change hai - table rewrite nahi."""
+    cur.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS key_id SMALLINT")
+    cur.execute("ALTER TABLE conversation_state ADD COLUMN IF NOT EXISTS last_key_id SMALLINT")
+
+def m008_search(con, cur):
+    """Message full-text index (storage likhta hai, purane rows `jobs.py reindex`
+    se) aur username typeahead ke liye lower(username) ka "C" collation index -
+    prefix range scan usi order mein sorted result deta hai."""
+    cur.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS search TSVECTOR")
+    _create_index(cur, "messages_search_idx", "INDEX ON messages USING GIN (search)")
+    _create_index(cur, "users_username_prefix_idx", 'INDEX ON users (lower(username) COLLATE "C")')
+
+
+# Partitioned messages table par same naam wale indexes (purane table ke indexes attach ho jaate hain)
+_MESSAGE_INDEXES = {
+    "conversation_idx": "(user_lo, user_hi, id)",
+    "search_idx": "USING GIN (search)",
+    "deleted_idx": "(id) WHERE deleted_by_sender=1 AND deleted_by_receiver=1",
+}
+
+def m009_message_retention(con, cur):
+    """messages ko id range partitions mein badalta hai aur doubly-deleted rows ke
+    liye partial index (jobs.py compact).
+
+    ids waqt ke saath badhti hain, to har partition ek time range hai; saari
+    queries id par filter / order karti hain, to pruning unhe bhi milti hai
+    (timestamp par partition karne se nahi milti, aur primary key (id) bhi
+    global reh sakti hai). Retention purane partitions drop karke hoti hai.
+
+    Data copy nahi hota: purana table as-is pehla partition (MINVALUE..cutover)
+    ban jaata hai. Uske indexes pehle se bane hain to ATTACH sirf metadata hai,
+    aur range validated CHECK constraint se proof hoti hai (scan nahi).
+    """
+    # Unread counts aur conversation list m006 se conversation_state se aate hain - in
+    # indexes ko koi query use nahi karti, har insert par (har partition mein) bas kharcha
+    concurrently = "" if _is_partitioned(cur, "messages") else "CONCURRENTLY "
+    for name in ("messages_unread_idx", "messages_sender_idx"):
+        cur.execute(f"DROP INDEX {concurrently}IF EXISTS {name}")
+
+    if not _is_partitioned(cur, "messages"):
+        _create_index(cur, "messages_deleted_idx", "INDEX ON messages " + _MESSAGE_INDEXES["deleted_idx"])
+        # Migration ke dauraan likhe jaane wale rows ke liye ek partition ka margin
+        cur.execute("SELECT last_value FROM messages_id_seq")
+        cutover = (cur.fetchone()[0] // PARTITION_SIZE + 2) * PARTITION_SIZE
+        cur.execute("ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_legacy_range")
+        cur.execute(f"ALTER TABLE messages ADD CONSTRAINT messages_legacy_range CHECK (id < {cutover}) NOT VALID")
+        cur.execute("ALTER TABLE messages VALIDATE CONSTRAINT messages_legacy_range")
+
+        # Khaali partitioned parent - iske indexes / trigger banana turant hai
+        cur.execute("DROP TABLE IF EXISTS messages_partitioned")
+        cur.execute("CREATE TABLE messages_partitioned (LIKE messages INCLUDING DEFAULTS) PARTITION BY RANGE (id)")
+        cur.execute("ALTER TABLE messages_partitioned ADD CONSTRAINT messages_partitioned_pkey PRIMARY KEY (id)")
+        for suffix, definition in _MESSAGE_INDEXES.items():
+            cur.execute(f"CREATE INDEX messages_partitioned_{suffix} ON messages_partitioned {definition}")
+        cur.execute("""
+            CREATE TRIGGER messages_partitioned_conversation_key
+            BEFORE INSERT OR UPDATE OF sender, receiver ON messages_partitioned
+            FOR EACH ROW EXECUTE FUNCTION messages_conversation_key()
+        """)
+
+        # Swap: ek chhoti transaction, sirf renames aur attach
+        with con:
+            cur.execute("ALTER TABLE messages RENAME TO messages_legacy")
+            for suffix in ("pkey", *_MESSAGE_INDEXES):
+                cur.execute(f"ALTER INDEX messages_{suffix} RENAME TO messages_legacy_{suffix}")
+            cur.execute("DROP TRIGGER messages_conversation_key ON messages_legacy")
+            cur.execute("ALTER TABLE messages_partitioned RENAME TO messages")
+            cur.execute(f"ALTER TABLE messages ATTACH PARTITION messages_legacy FOR VALUES FROM (MINVALUE) TO ({cutover})")
+            for suffix in ("pkey", *_MESSAGE_INDEXES):
+                cur.execute(f"ALTER INDEX messages_partitioned_{suffix} RENAME TO messages_{suffix}")
+            cur.execute("ALTER TRIGGER messages_partitioned_conversation_key ON messages RENAME TO messages_conversation_key")
+            # Purana table drop ho (retention) to sequence saath na jaaye
+            cur.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+        cur.execute("ALTER TABLE messages_legacy DROP CONSTRAINT messages_legacy_range")
+
+    ensure_message_partitions(cur)
+    # Partitions waqt par na bane hon to bhi insert fail na ho
+    cur.execute("CREATE TABLE IF NOT EXISTS messages_default PARTITION OF messages DEFAULT")
+
+
+MIGRATIONS = [
+    (1, "base tables", m001_base_tables),
+    (2, "message ids", m002_message_ids),
+    (3, "conversation key", m003_conversation_key),
+    (4, "message indexes", m004_message_indexes),
+    (5, "blocks primary key", m005_blocks_primary_key),
+    (6, "conversation state", m006_conversation_state),
+    (7, "encryption key ids", m007_encryption_key_ids),
+    (8, "search", m008_search),
+    (9, "message retention", m009_message_retention),
+]
+LATEST = MIGRATIONS[-1][0]
+
+
+# ---------------- SQLITE ----------------
+# Embedded DB par wahi schema aur indexes. Sab kuch ek transaction mein chalta
+# hai (SQLite DDL transactional hai), isliye online tricks ki zarurat nahi.
+def _sqlite_columns(cur, table):
+    cur.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in cur.fetchall()}
+
+def s001_base_tables(con, cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS users (
+        username TEXT PRIMARY KEY,
+        email TEXT UNIQUE,
+        password TEXT
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender TEXT,
+        receiver TEXT,
+        msg TEXT,
+        is_read INTEGER DEFAULT 0,
+        timestamp TIMESTAMP,
+        deleted_by_sender INTEGER DEFAULT 0,
+        deleted_by_receiver INTEGER DEFAULT 0
+    )
+    """)
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS blocks (
+        blocker TEXT,
+        blocked TEXT
+    )
+    """)
+
+def s002_message_ids(con, cur):
+    # Purani chat.db mein id nahi thi: table rebuild, ids timestamp order mein.
+    # AUTOINCREMENT taaki delete ke baad bhi id dobara use na ho (cursors ke liye).
+    if "id" in _sqlite_columns(cur, "messages"):
+        return
+    cur.execute("""
+    CREATE TABLE messages_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sender TEXT,
+        receiver TEXT,
+        msg TEXT,
+        is_read INTEGER DEFAULT 0,
+        timestamp TIMESTAMP,
+        deleted_by_sender INTEGER DEFAULT 0,
+        deleted_by_receiver INTEGER DEFAULT 0
+    )
+    """)
+    cur.execute("""
+        INSERT INTO messages_new (sender, receiver, msg, is_read, timestamp, deleted_by_sender, deleted_by_receiver)
+        SELECT sender, receiver, msg, is_read, timestamp, deleted_by_sender, deleted_by_receiver
+        FROM messages ORDER BY timestamp, rowid
+    """)
+    cur.execute("DROP TABLE messages")
+    cur.execute("ALTER TABLE messages_new RENAME TO messages")
+
+def s003_conversation_key(con, cur):
+    # Virtual generated columns: BINARY collation = codepoint order, Python jaisa
+    columns = _sqlite_columns(cur, "messages")
+    if "user_lo" not in columns:
+        cur.execute("ALTER TABLE messages ADD COLUMN user_lo TEXT GENERATED ALWAYS AS (min(sender, receiver)) VIRTUAL")
+    if "user_hi" not in columns:
+        cur.execute("ALTER TABLE messages ADD COLUMN user_hi TEXT GENERATED ALWAYS AS (max(sender, receiver)) VIRTUAL")
+
+def s004_message_indexes(con, cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS messages_conversation_idx ON messages (user_lo, user_hi, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS messages_unread_idx ON messages (receiver, sender, is_read)")
+    cur.execute("CREATE INDEX IF NOT EXISTS messages_sender_idx ON messages (sender, id)")
+
+def s005_blocks_primary_key(con, cur):
+    cur.execute("""
+        DELETE FROM blocks WHERE blocker IS NULL OR blocked IS NULL
+           OR rowid NOT IN (SELECT MIN(rowid) FROM blocks GROUP BY blocker, blocked)
+    """)
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS blocks_pkey ON blocks (blocker, blocked)")
+
+def s006_conversation_state(con, cur):
+    cur.execute(_STATE_TABLE)
+    cur.execute(_STATE_INDEX)
+    cur.execute(_STATE_BACKFILL)
+
+def s007_encryption_key_ids(con, cur):
+    if "key_id" not in _sqlite_columns(cur, "messages"):
+        cur.execute("ALTER TABLE messages ADD COLUMN key_id INTEGER")
+    if "last_key_id" not in _sqlite_columns(cur, "conversation_state"):
+        cur.execute("ALTER TABLE conversation_state ADD COLUMN last_key_id INTEGER")
+
+def s008_search(con, cur):
+    # Contentless FTS5: msg encrypted ho sakta hai, to text copy nahi rakhte, sirf index
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts
+        USING fts5(body, parties, content='', tokenize='unicode61 remove_diacritics 2')
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS users_username_prefix_idx ON users (lower(username))")
+
+def s009_message_retention(con, cur):
+    # Embedded DB partition nahi hota; compaction ke liye partial index kaafi hai
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS messages_deleted_idx ON messages (id)
+        WHERE deleted_by_sender=1 AND deleted_by_receiver=1
+    """)
+    # Postgres ki tarah: conversation_state ke baad inhe koi query use nahi karti
+    cur.execute("DROP INDEX IF EXISTS messages_unread_idx")
+    cur.execute("DROP INDEX IF EXISTS messages_sender_idx")
+
+
+
+SQLITE_MIGRATIONS = [
+    (1, "base tables", s001_base_tables),
+    (2, "message ids", s002_message_ids),
+    (3, "conversation key", s003_conversation_key),
+    (4, "message indexes", s004_message_indexes),
+    (5, "blocks primary key", s005_blocks_primary_key),
+    (6, "conversation state", s006_conversation_state),
+    (7, "encryption key ids", s007_encryption_key_ids),
+    (8, "search", s008_search),
+    (9, "message retention", s009_message_retention),
+]
+assert SQLITE_MIGRATIONS[-1][0] == LATEST
+
+
+# ---------------- RUNNER ----------------
+def current_version(cur):
+    cur.execute("SELECT to_regclass('schema_migrations') IS NOT NULL")
+    if not cur.fetchone()[0]:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cur.fetchone()[0]
+
+def schema_version(cur):
+    """Applied schema version, kisi bhi backend ke cursor par (table na ho to 0, error nahi)."""
+    if storage.get_backend().name == "postgres":
+        return current_version(cur)
+    cur.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='schema_migrations'")
+    if cur.fetchone() is None:
+        return 0
+    cur.execute("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")
+    return cur.fetchone()[0]
+
+def _apply(cur, migrations, done, step_args):
+    applied = []
+    for version, name, step in migrations:
+        if version in done:
+            continue
+        started = time.monotonic()
+        step(*step_args)
+        cur.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        applied.append(version)
+        log.info("Migration %03d %s applied in %.2fs", version, name, time.monotonic() - started)
+    return applied
+
+def migrate(wait=False):
+    """Pending migrations chalata hai. Applied versions ki list return karta hai.
+
+    wait=False par agar koi aur instance migrate kar raha ho to turant laut aata
+    hai (app start ko block nahi karta); CLI wait=True use karta hai.
+    """
+    con = storage.get_connection()
+    try:
+        if storage.get_backend().name == "sqlite":
+            return _migrate_sqlite(con)
+        return _migrate_postgres(con, wait)
+    finally:
+        con.close()
+
+def _migrate_postgres(con, wait):
+    con.autocommit = True
+    cur = con.cursor()
+    if current_version(cur) >= LATEST:
+        return []
+    if wait:
+        cur.execute("SELECT pg_advisory_lock(%s)", (LOCK_KEY,))
+    else:
+        cur.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_KEY,))
+        if not cur.fetchone()[0]:
+            log.info("Migrations already running in another instance, skipping.")
+            return []
+    try:
+        cur.execute(f"SET lock_timeout = '{LOCK_TIMEOUT}'")
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT now()
+            )
+        """)
+        cur.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cur.fetchall()}
+        return _apply(cur, MIGRATIONS, done, (con, cur))
+    finally:
+        cur.execute("SELECT pg_advisory_unlock(%s)", (LOCK_KEY,))
+
+def _migrate_sqlite(con):
+    con.isolation_level = None
+    cur = storage.get_backend().cursor(con)
+    if schema_version(cur) >= LATEST:
+        return []
+    # IMMEDIATE: write lock pehle hi, dusra process yahin wait karega
+    cur.execute("BEGIN IMMEDIATE")
+    try:
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        cur.execute("SELECT version FROM schema_migrations")
+        done = {row[0] for row in cur.fetchall()}
+        applied = _apply(cur, SQLITE_MIGRATIONS, done, (con, cur))
+        cur.execute("COMMIT")
+        return applied
+    except Exception:
+        cur.execute("ROLLBACK")
+        raise
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    applied = migrate(wait=True)
+    print(f"Applied {len(applied)} migration(s); schema at version {LATEST}.")
+    sys.exit(0)
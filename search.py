@@ -0,0 +1,86 @@
+"""Search helpers: username typeahead aur messages ka full-text search.
+
+Users: lower(username) par index; prefix search ek range scan hai
+(>= prefix, < prefix ke baad wala string), LIKE nahi, to pattern escape ki
+zarurat nahi aur index se hi sorted result + LIMIT milta hai.
+
+Messages: Postgres mein messages.search (tsvector, GIN index), SQLite mein
+contentless FTS5 table messages_fts (rowid = message id). msg column encrypted
+ho sakta hai, isliye index DB trigger nahi balki storage plaintext se likhta
+hai. Har message ke index mein dono participants ka owner token bhi hota hai,
+to "mere messages mein X" ek hi index lookup hai - poore table ke matches
+nikaal kar user ke hisaab se filter nahi karne padte.
+
+Index mein message ke words plaintext hote hain, to encryption at rest ke saath
+index unhe wapas khol deta hai. Isliye ENCRYPTION_KEYS set ho to message search
+default band hai - MESSAGE_SEARCH=1 se jaan-boojh kar chalu karein (startup par
+warning aati hai). Band ho to naye messages index nahi hote.
+
+Purane (index se pehle ke) messages:  python jobs.py reindex
+
+  MESSAGE_SEARCH=1      (default: encryption na ho to 1, ho to 0)
+"""
+import os
+import re
+import hashlib
+import logging
+
+try:
+    from . import crypto
+except (ImportError, ValueError):
+    import crypto
+
+log = logging.getLogger("chat.search")
+
+_setting = os.getenv("MESSAGE_SEARCH")
+if _setting is None:
+    MESSAGE_SEARCH = not crypto.configured()
+else:
+    MESSAGE_SEARCH = _setting.lower() in ("1", "true", "yes", "on")
+if MESSAGE_SEARCH and crypto.configured():
+    log.warning("MESSAGE_SEARCH is on with ENCRYPTION_KEYS set - message words are stored unencrypted in the search index")
+
+# Username typeahead ka result size
+USER_LIMIT = 10
+MAX_USER_LIMIT = 50
+
+_WORD = re.compile(r"\w+")
+
+
+def owner_token(username):
+    """Index mein user ka token: hash, taaki tokenizer username ko tod na de."""
+    return "u" + hashlib.sha1(username.encode()).hexdigest()[:16]
+
+
+def owners(sender, receiver):
+    return " ".join(sorted({owner_token(sender), owner_token(receiver)}))
+
+
+def document(sender, receiver, msg):
+    """Message ka index document (text, owner tokens); index band ho to (None, None)."""
+    if not MESSAGE_SEARCH or not msg:
+        return None, None
+    return msg, owners(sender, receiver)
+
+
+def has_terms(query):
+    return bool(_WORD.search(query or ""))
+
+
+def fts_query(user, query):
+    """FTS5 MATCH expression: user ke messages jinme query ke saare words hon.
+    Har word quoted phrase hai, to user input FTS5 syntax ke roop mein nahi chalta."""
+    words = " ".join('"%s"' % w.replace('"', '""') for w in _WORD.findall(query or ""))
+    return f"parties : {owner_token(user)} AND body : ({words})"
+
+
+def fold(text, ascii_only=False):
+    """DB ke lower() jaisa. SQLite ka lower() sirf ASCII badalta hai."""
+    if ascii_only:
+        return "".join(c.lower() if c.isascii() else c for c in text)
+    return text.lower()
+
+
+def prefix_range(prefix):
+    """prefix se shuru hone wale saare strings [lo, hi) mein (codepoint order)."""
+    return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
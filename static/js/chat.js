@@ -1,5 +1,14 @@
 let currentChatUser = null;
-let inboxTimer = null;
+let inboxTimer = null;      // fallback polling timer
+let waitController = null;  // long-poll request ko abort karne ke liye
+const PAGE_SIZE = 50;
+let lastMessageId = 0;      // sabse naya message jo screen par hai
+let oldestMessageId = null; // scroll back ke liye cursor
+let hasOlder = true;
+let loadingOlder = false;
+let conversationsCursor = null; // list ke sabse purane item ka last.id
+let hasMoreConversations = false;
+let loadingConversations = false;
 let emojiOpen = false;
 let CURRENT_USER = "";
 
@@ -24,6 +33,16 @@ document.addEventListener("DOMContentLoaded", () => {
     }
 
     loadConversations();
+
+    // List ke neeche pahunchne par agle conversations load karo
+    userList.addEventListener("scroll", () => {
+        if (userList.scrollHeight - userList.scrollTop - userList.clientHeight < 60) loadMoreConversations();
+    });
+
+    // Upar scroll karne par purane messages load karo
+    chatBox.addEventListener("scroll", () => {
+        if (chatBox.scrollTop < 40) loadOlderMessages();
+    });
     
     // Close menu if clicking outside
     document.addEventListener("click", (e) => {
@@ -74,10 +93,26 @@ async function searchUser() {
 
 /* ================= LOAD CONVERSATIONS (Clean) ================= */
 async function loadConversations() {
-    const r = await fetch("/conversations");
+    const r = await fetch(`/conversations?limit=${PAGE_SIZE}`);
     const data = await r.json();
     userList.innerHTML = "";
-    
+    conversationsCursor = null;
+    renderConversations(data);
+}
+
+// Agla page (keyset cursor: last.id)
+async function loadMoreConversations() {
+    if (!hasMoreConversations || loadingConversations || conversationsCursor === null) return;
+    loadingConversations = true;
+    try {
+        const r = await fetch(`/conversations?limit=${PAGE_SIZE}&before=${conversationsCursor}`);
+        renderConversations(await r.json());
+    } finally {
+        loadingConversations = false;
+    }
+}
+
+function renderConversations(data) {
     data.forEach(item => {
         const u = item.user; 
         const d = document.createElement("div");
@@ -95,25 +130,65 @@ async function loadConversations() {
         d.onclick = () => openChat(u);
         userList.appendChild(d);
     });
+    if (data.length) conversationsCursor = data[data.length - 1].last.id;
+    hasMoreConversations = data.length === PAGE_SIZE;
 }
 /* ================= OPEN CHAT ================= */
 function openChat(user) {
-    if (inboxTimer) clearInterval(inboxTimer);
+    stopLiveUpdates();
     
     currentChatUser = user;
     chatUser.textContent = user;
 
+    // Naya chat -> cursors reset
+    chatBox.innerHTML = "";
+    lastMessageId = 0;
+    oldestMessageId = null;
+    hasOlder = true;
+
     leftPanel.classList.add("hidden");
     rightPanel.classList.add("active");
 
-    loadMessages();
-    inboxTimer = setInterval(loadMessages, 2000);
+    loadMessages().then(() => startLiveUpdates(user));
+}
+
+/* ================= LIVE UPDATES ================= */
+// Long-poll /inbox/wait: server naya message aate hi jawab deta hai.
+// Agar long-poll kaam na kare to purane 2s polling par wapas chale jao.
+async function startLiveUpdates(chatWith) {
+    if (chatWith !== currentChatUser) return;
+    waitController = new AbortController();
+    const signal = waitController.signal;
+
+    while (chatWith === currentChatUser && !signal.aborted) {
+        try {
+            const r = await fetch(`/inbox/wait/${chatWith}?after=${lastMessageId}`, { signal });
+            if (!r.ok) throw new Error("wait failed: " + r.status);
+            const data = await r.json();
+            if (chatWith !== currentChatUser) return;
+            appendMessages(data);
+        } catch (e) {
+            if (signal.aborted) return;
+            if (chatWith === currentChatUser && !inboxTimer) {
+                inboxTimer = setInterval(loadMessages, 2000);
+            }
+            return;
+        }
+    }
+}
+
+function stopLiveUpdates() {
+    if (waitController) waitController.abort();
+    waitController = null;
+    if (inboxTimer) clearInterval(inboxTimer);
+    inboxTimer = null;
 }
 
 /* ================= BACK ================= */
 async function goBack() {
-    // 1. Polling timer band karein
-    if (inboxTimer) clearInterval(inboxTimer);
+    // 1. Live updates (long-poll / polling) band karein
+    stopLiveUpdates();
+    currentChatUser = null;
     
     // 2. UI switch karein
     rightPanel.classList.remove("active");
@@ -139,19 +214,64 @@ async function sendMessage() {
 }
 
 /* ================= LOAD MESSAGES ================= */
+function renderBubble(m) {
+    const d = document.createElement("div");
+    d.className = m.from === CURRENT_USER ? "bubble sent" : "bubble received";
+    d.textContent = m.msg;
+    return d;
+}
+
+// Sirf naye messages (delta) laata hai aur neeche append karta hai
 async function loadMessages() {
     if (!currentChatUser) return;
-    const r = await fetch("/inbox/" + currentChatUser);
+    const chatWith = currentChatUser;
+    const url = lastMessageId
+        ? `/inbox/${chatWith}?after=${lastMessageId}&limit=${PAGE_SIZE}`
+        : `/inbox/${chatWith}?limit=${PAGE_SIZE}`;
+    const r = await fetch(url);
     const data = await r.json();
+    if (chatWith !== currentChatUser || !Array.isArray(data)) return;
 
-    chatBox.innerHTML = "";
-    data.forEach(m => {
-        const d = document.createElement("div");
-        d.className = m.from === CURRENT_USER ? "bubble sent" : "bubble received";
-        d.textContent = m.msg;
-        chatBox.appendChild(d);
-    });
-    chatBox.scrollTop = chatBox.scrollHeight;
+    appendMessages(data);
+}
+
+function appendMessages(data) {
+    // Do requests ek saath aa jayein to duplicate na ho
+    const fresh = data.filter(m => m.id > lastMessageId);
+    if (!fresh.length) return;
+
+    const atBottom = chatBox.scrollHeight - chatBox.scrollTop - chatBox.clientHeight < 60;
+    fresh.forEach(m => chatBox.appendChild(renderBubble(m)));
+
+    if (oldestMessageId === null) oldestMessageId = fresh[0].id;
+    lastMessageId = fresh[fresh.length - 1].id;
+    if (atBottom || fresh.some(m => m.from === CURRENT_USER)) {
+        chatBox.scrollTop = chatBox.scrollHeight;
+    }
+}
+
+// Keyset pagination: oldestMessageId se pehle wale messages upar jodo
+async function loadOlderMessages() {
+    if (!currentChatUser || !hasOlder || loadingOlder || oldestMessageId === null) return;
+    loadingOlder = true;
+    const chatWith = currentChatUser;
+    try {
+        const r = await fetch(`/inbox/${chatWith}?before=${oldestMessageId}&limit=${PAGE_SIZE}`);
+        const data = await r.json();
+        if (chatWith !== currentChatUser || !Array.isArray(data)) return;
+        if (data.length < PAGE_SIZE) hasOlder = false;
+        if (!data.length) return;
+
+        const prevHeight = chatBox.scrollHeight;
+        const frag = document.createDocumentFragment();
+        data.forEach(m => frag.appendChild(renderBubble(m)));
+        chatBox.prepend(frag);
+        oldestMessageId = data[0].id;
+        // Scroll position wahi rahe jahan user tha
+        chatBox.scrollTop += chatBox.scrollHeight - prevHeight;
+    } finally {
+        loadingOlder = false;
+    }
 }
 
 /* ================= MENU ================= */
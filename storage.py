@@ -1,250 +1,706 @@
 import os
-import psycopg2
-from psycopg2 import extras
+import time
+import logging
+import threading
+import hashlib
+import contextvars
+from contextlib import contextmanager
 import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+import cache
+import crypto
+import search
+from hub import get_hub
+from backends import get_backend, get_db_url
+from metrics import instrument, phase, record_startup
 
-def get_db_url():
-    """Vercel Postgres URL ko clean aur format karne ke liye helper."""
-    url = os.environ.get('POSTGRES_URL') or os.environ.get('DATABASE_URL')
-    
-    if not url:
-        return None
-        
-    # Fix 1: psycopg2 'postgresql://' mangta hai, 'postgres://' nahi
-    if url.startswith("postgres://"):
-        url = url.replace("postgres://", "postgresql://", 1)
-    
-    # Fix 2: Supabase ya extra params jo error dete hain unhe hatao
-    # Hum sirf base URL use karenge aur sslmode manually add karenge
-    base_url = url.split("?")[0]
-    return f"{base_url}?sslmode=require"
+log = logging.getLogger("chat.storage")
+
+# Inbox / conversation list pagination
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+# conversation_state mein last message ka itna hissa rakha jaata hai
+PREVIEW_LENGTH = 100
+# /send_batch ek request mein itne messages tak
+MAX_BATCH_SIZE = 1000
+# Bulk queries: IN (...) list aur multi-row VALUES ka size (SQLite ki bound-parameter limit se neeche)
+IN_CHUNK = 500
+VALUES_CHUNK = 100
 
 def get_connection():
-    url = get_db_url()
-    if not url:
-        raise ValueError("Database URL missing! Dashboard se Postgres connect karein.")
-    return psycopg2.connect(url)
+    """Naya, pool ke bahar ka connection (LISTEN / migrations jaise kaam ke liye)."""
+    return get_backend().connect()
 
-def init_db():
-    con = None
+def get_pool():
+    return get_backend().pool
+
+def pool_stats():
+    return get_pool().stats()
+
+# ---------------- UNIT OF WORK ----------------
+class _Scope:
+    """Ek connection + transaction jo kai storage calls share karti hain."""
+    __slots__ = ("con", "callbacks")
+
+    def __init__(self):
+        self.con = None
+        self.callbacks = []
+
+_scope = contextvars.ContextVar("storage_scope", default=None)
+
+def _finish(scope):
+    con, callbacks = scope.con, scope.callbacks
+    scope.con, scope.callbacks = None, []
+    if con is not None:
+        try:
+            with phase("commit"):
+                con.commit()
+        except Exception:
+            _release(con, rollback=True)
+            raise
+        _release(con)
+    for fn in callbacks:
+        fn()
+
+def _abort(scope):
+    con = scope.con
+    scope.con, scope.callbacks = None, []
+    if con is not None:
+        _release(con, rollback=True)
+
+def _release(con, rollback=False):
+    broken = get_backend().is_closed(con)
+    if rollback and not broken:
+        try:
+            con.rollback()
+        except Exception:
+            broken = True
+    get_pool().putconn(con, close=broken)
+
+@contextmanager
+def transaction(dict_rows=False):
+    """Storage ka unit of work, cursor yield karta hai.
+
+    Request scope (begin_request) active ho to usi connection aur transaction
+    ko reuse karta hai - commit end_request par hota hai. Warna pool se
+    connection leke khud commit/rollback karta hai. Error par poori
+    transaction rollback hoti hai.
+    """
+    scope = _scope.get()
+    owner = scope is None
+    if owner:
+        scope = _Scope()
+        token = _scope.set(scope)
     try:
-        con = get_connection()
-        cur = con.cursor()
-        # USERS Table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            username TEXT PRIMARY KEY,
-            email TEXT UNIQUE,
-            password TEXT
-        )
-        """)
-        # MESSAGES Table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS messages (
-            sender TEXT, 
-            receiver TEXT, 
-            msg TEXT, 
-            is_read INTEGER DEFAULT 0, 
-            timestamp TIMESTAMP,
-            deleted_by_sender INTEGER DEFAULT 0,
-            deleted_by_receiver INTEGER DEFAULT 0
-        )
-        """)
-        # BLOCKS Table
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS blocks (
-            blocker TEXT, 
-            blocked TEXT
-        )
-        """)
-        con.commit()
-        cur.close()
-        print("Database initialized successfully.")
-    except Exception as e:
-        print(f"Error initializing database: {e}")
+        if scope.con is None:
+            scope.con = get_pool().getconn()
+        cur = get_backend().cursor(scope.con, dict_rows)
+        failed = False
+        try:
+            yield cur
+        except Exception:
+            failed = True
+            raise
+        finally:
+            # Cursor connection ke pool mein lautne se pehle band ho
+            cur.close()
+            if failed:
+                _abort(scope)
     finally:
-        if con:
-            con.close()
+        if owner:
+            _scope.reset(token)
+    if owner:
+        _finish(scope)
+
+def after_commit(fn):
+    """fn ko current transaction commit hone ke baad chalao (e.g. waiters ko jagana)."""
+    scope = _scope.get()
+    if scope is None:
+        fn()
+    else:
+        scope.callbacks.append(fn)
+
+def begin_request():
+    """Request ke saare storage calls ek connection/transaction share karenge."""
+    _scope.set(_Scope())
+
+def end_request(error=None):
+    """Request scope khatam: error (exception ya True) na ho to commit, warna rollback.
+    Dobara call safe hai."""
+    scope = _scope.get()
+    if scope is None:
+        return
+    _scope.set(None)
+    if not error:
+        _finish(scope)
+    else:
+        _abort(scope)
+
+def release_connection():
+    """Scope chalu rakhte hue ab tak ka kaam commit karke connection pool ko lauta do.
+    Long-poll jaise lambe waits se pehle call karein."""
+    scope = _scope.get()
+    if scope is not None:
+        _finish(scope)
+
+def init_db():
+    """Schema ko latest version tak migrate karta hai (dekhein migrations.py)."""
+    try:
+        import migrations
+        migrations.migrate()
+        log.info("Database initialized successfully.")
+    except Exception:
+        log.exception("Error initializing database")
+
+# Pehli request par schema check (peeche ho to migrate). Deploy par `python migrations.py`
+# chalayein aur AUTO_MIGRATE=0 rakhein to request path mein schema ka koi kaam nahi hota.
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "1").lower() in ("1", "true", "yes", "on")
+# Migration fail ho (ya koi aur instance kar raha ho) to itne seconds tak dobara koshish nahi
+SCHEMA_RETRY_SECONDS = float(os.getenv("SCHEMA_RETRY_SECONDS", "30"))
+_schema_ready = not AUTO_MIGRATE
+_schema_retry_at = 0.0
+_schema_lock = threading.Lock()
+
+def ensure_schema():
+    """Process mein ek baar. Version check request ke apne pooled connection par
+    hota hai (cold start par alag connection / DDL nahi); migrations sirf tab
+    jab schema sach mein peeche ho. Na ho paaye to SCHEMA_RETRY_SECONDS tak
+    requests seedhe aage badhti hain - har request lock ke peeche DDL dobara nahi chalati."""
+    global _schema_ready, _schema_retry_at
+    if _schema_ready or time.monotonic() < _schema_retry_at:
+        return
+    with _schema_lock:
+        if _schema_ready or time.monotonic() < _schema_retry_at:
+            return
+        import migrations
+        started = time.perf_counter()
+        try:
+            with transaction() as cur:
+                version = migrations.schema_version(cur)
+            if version < migrations.LATEST:
+                release_connection()
+                migrations.migrate()
+                with transaction() as cur:
+                    version = migrations.schema_version(cur)
+            # Koi aur instance abhi migrate kar raha ho to retry ke baad phir dekhenge
+            _schema_ready = version >= migrations.LATEST
+        except Exception:
+            log.exception("Schema check error (retry in %.0fs)", SCHEMA_RETRY_SECONDS)
+        if not _schema_ready:
+            _schema_retry_at = time.monotonic() + SCHEMA_RETRY_SECONDS
+        record_startup("schema", time.perf_counter() - started)
+
+def conversation_key(u1, u2):
+    """Conversation ki canonical key (user_lo, user_hi) - dono taraf se same.
+    Codepoint order, jo migrations ke trigger ke COLLATE "C" se match karta hai."""
+    return (u1, u2) if u1 <= u2 else (u2, u1)
+
+# ---------------- CACHE ----------------
+_watching = False
+
+def _watch_invalidations():
+    """Pehli cache fill par dusre instances ki invalidations ka handler (dekhein cache.py, CACHE_LISTEN)."""
+    global _watching
+    if not _watching:
+        _watching = True
+        get_hub().on_invalidate(cache.apply_invalidation, listen=cache.CACHE_LISTEN)
+
+def _invalidate(cur, name, key):
+    """Commit ke baad is process ka cache, aur (Postgres hub par) baaki instances ka bhi."""
+    get_hub().invalidate_tx(cur, name, key)
+    after_commit(lambda: cache.invalidate(name, key))
+
+def _lookup_many(c, keys, load):
+    """keys mein se jo cache ke hisaab se ya DB (load(misses) -> set) mein maujood hain.
+    DB se padhi keys (mili ya nahi) cache ho jaati hain."""
+    found, misses = set(), []
+    for key in keys:
+        value = c.get(key)
+        if value is cache.MISSING:
+            misses.append(key)
+        elif value:
+            found.add(key)
+    if misses:
+        _watch_invalidations()
+        generation = c.generation
+        loaded = load(misses)
+        for key in misses:
+            c.set(key, key in loaded, generation)
+        found |= loaded
+    return found
 
 # ---------------- USERS ----------------
+@instrument
 def create_user(username, email, password):
-    con = None
     try:
-        con = get_connection()
-        cur = con.cursor()
         hashed = generate_password_hash(password)
-        cur.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)", 
-                    (username, email, hashed))
-        con.commit()
+        with transaction() as cur:
+            cur.execute("INSERT INTO users (username, email, password) VALUES (%s, %s, %s)", 
+                        (username, email, hashed))
+            _invalidate(cur, "users", username)
         return True
     except Exception as e:
-        print(f"Create user error: {e}")
+        log.warning("Create user error: %s", e)
         return False
-    finally:
-        if con:
-            con.close()
 
+@instrument
 def verify_login(email, password):
-    con = None
     try:
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("SELECT username, password FROM users WHERE email=%s", (email,))
-        row = cur.fetchone()
+        with transaction() as cur:
+            cur.execute("SELECT username, password FROM users WHERE email=%s", (email,))
+            row = cur.fetchone()
         if row and check_password_hash(row[1], password):
             return row[0]
         return None
-    except Exception as e:
-        print(f"Login Error: {e}")
+    except Exception:
+        log.exception("Login error")
         return None
-    finally:
-        if con:
-            con.close()
 
+@instrument
 def user_exists(username):
-    con = None
+    """Cached (unknown usernames bhi, thodi der) - dekhein cache.py."""
+    exists = cache.users.get(username)
+    if exists is not cache.MISSING:
+        return exists
+    _watch_invalidations()
+    generation = cache.users.generation
     try:
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("SELECT 1 FROM users WHERE username=%s", (username,))
-        exists = cur.fetchone() is not None
+        with transaction() as cur:
+            cur.execute("SELECT 1 FROM users WHERE username=%s", (username,))
+            exists = cur.fetchone() is not None
+        cache.users.set(username, exists, generation)
         return exists
-    except:
+    except Exception:
+        log.exception("User lookup error")
         return False
-    finally:
-        if con:
-            con.close()
 
 # ---------------- MESSAGES ----------------
+@instrument
 def store_message(sender, receiver, msg):
-    con = None
+    """Message save karta hai aur dono users ke waiters ko jagata hai. Naya id return karta hai."""
     try:
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("""
-            INSERT INTO messages (sender, receiver, msg, timestamp)
-            VALUES (%s, %s, %s, %s)
-        """, (sender, receiver, msg, datetime.datetime.now()))
-        con.commit()
-    except Exception as e:
-        print(f"Store Message Error: {e}")
-    finally:
-        if con:
-            con.close()
+        with transaction() as cur:
+            _lock_conversations(cur, [(sender, receiver)])
+            now = datetime.datetime.now()
+            msg_id = _insert_messages(cur, [(sender, receiver, msg, now)])[0]
+            _update_state(cur, sender, receiver, msg_id, msg, now)
+            get_hub().notify_tx(cur, sender, receiver)
+            after_commit(lambda: get_hub().publish(sender, receiver))
+        return msg_id
+    except Exception:
+        log.exception("Store message error")
+        return None
+
+@instrument
+def store_messages(sender, items):
+    """Bulk send: items = [(receiver, msg), ...]. Har item ka result usi order
+    mein - {"id": ...} ya {"error": ...}.
+
+    Recipients aur blocks set-based queries se check hote hain aur saare valid
+    messages ek transaction mein insert hote hain (conversation_state bhi ek
+    multi-row upsert se), to cost per message nahi, per batch lagti hai.
+    """
+    results = [None] * len(items)
+    valid = []
+    for i, (receiver, msg) in enumerate(items):
+        if not isinstance(receiver, str) or not receiver:
+            results[i] = {"error": "Recipient required"}
+        elif not isinstance(msg, str) or not msg:
+            results[i] = {"error": "Message required"}
+        else:
+            valid.append(i)
+    if not valid:
+        return results
 
-def get_messages_between(u1, u2):
-    con = None
     try:
-        con = get_connection()
-        cur = con.cursor(cursor_factory=extras.DictCursor)
-        # Mark as read
-        cur.execute("UPDATE messages SET is_read=1 WHERE sender=%s AND receiver=%s AND is_read=0", (u2, u1))
-        
-        cur.execute("""
-            SELECT sender, receiver, msg, timestamp FROM messages
-            WHERE ((sender=%s AND receiver=%s AND deleted_by_sender=0)
-               OR (sender=%s AND receiver=%s AND deleted_by_receiver=0))
-            ORDER BY timestamp ASC
-        """, (u1, u2, u2, u1))
-        
-        rows = cur.fetchall()
-        con.commit()
-        return [{"from": r['sender'], "to": r['receiver'], "msg": r['msg'], "time": r['timestamp']} for r in rows]
-    except Exception as e:
-        print(f"Fetch Messages Error: {e}")
+        with transaction() as cur:
+            receivers = sorted({items[i][0] for i in valid})
+            existing = _lookup_many(cache.users, receivers, lambda names: _load_users(cur, names))
+            pairs = [(r, sender) for r in receivers if r in existing]
+            blocked_by = {r for r, _ in _lookup_many(cache.blocks, pairs, lambda keys: _load_blocks(cur, keys))}
+            rows = []
+            for i in valid:
+                receiver = items[i][0]
+                if receiver not in existing:
+                    results[i] = {"error": "User does not exist"}
+                elif receiver in blocked_by:
+                    results[i] = {"error": "You are blocked"}
+                else:
+                    rows.append(i)
+            if rows:
+                _lock_conversations(cur, [(sender, items[i][0]) for i in rows])
+                now = datetime.datetime.now()
+                ids = _insert_messages(cur, [(sender, items[i][0], items[i][1], now) for i in rows])
+                _upsert_state(cur, _state_rows([(msg_id, sender, items[i][0], items[i][1], now)
+                                                for i, msg_id in zip(rows, ids)]))
+                users = {sender, *(items[i][0] for i in rows)}
+                get_hub().notify_tx(cur, *users)
+                after_commit(lambda: get_hub().publish(*users))
+                for i, msg_id in zip(rows, ids):
+                    results[i] = {"id": msg_id}
+    except Exception:
+        log.exception("Store messages error")
+        return [r if r is not None and "error" in r else {"error": "Could not store message"} for r in results]
+    return results
+
+def _select_in(cur, sql, values, params=()):
+    """sql ke {} mein values ki IN list; badi lists chunks mein. Pehla column return."""
+    out = []
+    for start in range(0, len(values), IN_CHUNK):
+        chunk = values[start:start + IN_CHUNK]
+        cur.execute(sql.format(", ".join(["%s"] * len(chunk))), [*params, *chunk])
+        out.extend(row[0] for row in cur.fetchall())
+    return out
+
+def _load_users(cur, names):
+    return set(_select_in(cur, "SELECT username FROM users WHERE username IN ({})", names))
+
+def _load_blocks(cur, pairs):
+    """pairs = [(blocker, blocked)] jinka blocked ek hi user hai -> jo pairs blocks mein hain."""
+    blocked = pairs[0][1]
+    blockers = _select_in(cur, "SELECT blocker FROM blocks WHERE blocked=%s AND blocker IN ({})",
+                          [blocker for blocker, _ in pairs], (blocked,))
+    return {(blocker, blocked) for blocker in blockers}
+
+def _lock_conversations(cur, pairs):
+    """Postgres: conversations par transaction tak advisory lock, id lene se pehle.
+    Warna T1 ko id 10, T2 ko 11 mile aur T2 pehle commit ho to ?after=11 wala
+    reader 10 kabhi nahi dekhta. Lock ke saath ek conversation mein id order =
+    commit order. Keys sorted order mein (deadlock nahi); SQLite mein ek hi writer hota hai."""
+    if get_backend().name != "postgres":
+        return
+    keys = sorted({int.from_bytes(hashlib.sha1("\0".join(conversation_key(*pair)).encode()).digest()[:8],
+                                  "big", signed=True) for pair in pairs})
+    cur.execute("SELECT pg_advisory_xact_lock(k) FROM unnest(%s::bigint[]) WITH ORDINALITY AS t(k, n) ORDER BY n",
+                (keys,))
+
+# messages.search: plaintext ke words + owner tokens (dekhein search.py). 'simple' = bina
+# stemming / stopwords, Hinglish messages ke liye wahi theek hai. NULL text -> NULL vector.
+_SEARCH_VECTOR = "to_tsvector('simple', %s) || CAST(%s AS tsvector)"
+
+def _insert_messages(cur, rows):
+    """rows = [(sender, receiver, msg, at)] ek saath insert (encrypted, search
+    index ke saath), ids usi order mein."""
+    with phase("crypto"):
+        encrypted = crypto.encrypt_many([msg for _, _, msg, _ in rows])
+    docs = [search.document(sender, receiver, msg) for sender, receiver, msg, _ in rows]
+    rows = [(sender, receiver, stored, at, key_id)
+            for (sender, receiver, _, at), (stored, key_id) in zip(rows, encrypted)]
+    if get_backend().name == "postgres":
+        if len(rows) == 1:
+            cur.execute(f"""
+                INSERT INTO messages (sender, receiver, msg, timestamp, key_id, search)
+                VALUES (%s, %s, %s, %s, %s, {_SEARCH_VECTOR}) RETURNING id
+            """, (*rows[0], *docs[0]))
+            return [cur.fetchone()[0]]
+        from psycopg2.extras import execute_values
+        # ids pehle le lo - multi-row RETURNING ka order guaranteed nahi hai
+        cur.execute("SELECT nextval('messages_id_seq') FROM generate_series(1, %s)", (len(rows),))
+        ids = sorted(row[0] for row in cur.fetchall())
+        execute_values(cur, "INSERT INTO messages (id, sender, receiver, msg, timestamp, key_id, search) VALUES %s",
+                       [(msg_id, *row, *doc) for msg_id, row, doc in zip(ids, rows, docs)],
+                       template=f"(%s, %s, %s, %s, %s, %s, {_SEARCH_VECTOR})", page_size=1000)
+        return ids
+    sql = "INSERT INTO messages (sender, receiver, msg, timestamp, key_id) VALUES (%s, %s, %s, %s, %s)"
+    if len(rows) == 1:
+        cur.execute(sql + " RETURNING id", rows[0])
+        ids = [cur.fetchone()[0]]
+    else:
+        cur.executemany(sql, rows)
+        cur.execute("SELECT last_insert_rowid()")
+        last = cur.fetchone()[0]
+        # Transaction write lock hold kiye hai, to AUTOINCREMENT ids lagataar mili hain
+        ids = list(range(last - len(rows) + 1, last + 1))
+    _index_fts(cur, [(msg_id, *doc) for msg_id, doc in zip(ids, docs)])
+    return ids
+
+def _index_fts(cur, docs):
+    """SQLite: docs = [(id, text, owner tokens)] messages_fts mein."""
+    docs = [doc for doc in docs if doc[1] is not None]
+    if docs:
+        cur.executemany("INSERT INTO messages_fts (rowid, body, parties) VALUES (%s, %s, %s)", docs)
+
+def _update_state(cur, sender, receiver, msg_id, msg, at):
+    _upsert_state(cur, _state_rows([(msg_id, sender, receiver, msg, at)]))
+
+def _state_rows(messages):
+    """messages = [(id, sender, receiver, msg, at)] -> har (owner, peer) ki ek
+    conversation_state row: sabse naya message aur receiver ke naye unread."""
+    state = {}
+    for msg_id, sender, receiver, msg, at in messages:
+        preview = (msg or "")[:PREVIEW_LENGTH]
+        for owner, peer, unread in {(sender, receiver, 0), (receiver, sender, 1 if sender != receiver else 0)}:
+            row = state.setdefault((owner, peer), [0, None, None, None, 0])
+            if msg_id > row[0]:
+                row[:4] = [msg_id, sender, preview, at]
+            row[4] += unread
+    return [(owner, peer, *row) for (owner, peer), row in sorted(state.items())]
+
+def _upsert_state(cur, rows):
+    """conversation_state rows upsert (receiver ka unread badhta hai). Rows
+    (owner, peer) order mein taaki ulti disha ke concurrent sends deadlock na
+    karein; GREATEST se out-of-order commits last message ko peeche nahi le jaate.
+    Preview bhi message ki tarah encrypted rehta hai."""
+    with phase("crypto"):
+        encrypted = crypto.encrypt_many([row[4] for row in rows])
+    rows = [(*row[:4], stored, row[5], row[6], key_id) for row, (stored, key_id) in zip(rows, encrypted)]
+    for start in range(0, len(rows), VALUES_CHUNK):
+        chunk = rows[start:start + VALUES_CHUNK]
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(chunk))
+        cur.execute(f"""
+            INSERT INTO conversation_state AS s
+                (owner, peer, last_message_id, last_sender, last_preview, last_at, unread, last_key_id)
+            VALUES {values}
+            ON CONFLICT (owner, peer) DO UPDATE SET
+                unread = s.unread + EXCLUDED.unread,
+                last_message_id = GREATEST(s.last_message_id, EXCLUDED.last_message_id),
+                last_sender = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+                                   THEN EXCLUDED.last_sender ELSE s.last_sender END,
+                last_preview = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+                                    THEN EXCLUDED.last_preview ELSE s.last_preview END,
+                last_at = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+                               THEN EXCLUDED.last_at ELSE s.last_at END,
+                last_key_id = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+                                   THEN EXCLUDED.last_key_id ELSE s.last_key_id END
+        """, [v for row in chunk for v in row])
+
+@instrument
+def get_messages_between(u1, u2, after=None, before=None, limit=PAGE_SIZE):
+    """u1 ke nazariye se u1 <-> u2 ke messages, id cursor ke saath.
+
+    after  -> sirf naye messages (id > after), purane se naye ki taraf
+    before -> scroll back ke liye purane messages (id < before)
+    dono nahi -> conversation ka latest page
+    Result hamesha id ASC order mein hota hai. Read mark karne ke liye mark_read() dekhein.
+    """
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    if after is not None:
+        cursor_sql, order, params = "AND id > %s", "ASC", [after]
+    elif before is not None:
+        cursor_sql, order, params = "AND id < %s", "DESC", [before]
+    else:
+        cursor_sql, order, params = "", "DESC", []
+
+    try:
+        with transaction(dict_rows=True) as cur:
+            cur.execute(f"""
+                SELECT id, sender, receiver, msg, timestamp, key_id FROM messages
+                WHERE user_lo=%s AND user_hi=%s
+                  AND ((sender=%s AND deleted_by_sender=0) OR (receiver=%s AND deleted_by_receiver=0))
+                  {cursor_sql}
+                ORDER BY id {order} LIMIT %s
+            """, [*conversation_key(u1, u2), u1, u1] + params + [limit])
+            rows = cur.fetchall()
+        if order == "DESC":
+            rows.reverse()
+        with phase("crypto"):
+            texts = crypto.decrypt_many([(r['msg'], r['key_id']) for r in rows])
+        return [{"id": r['id'], "from": r['sender'], "to": r['receiver'], "msg": text, "time": r['timestamp']}
+                for r, text in zip(rows, texts)]
+    except Exception:
+        log.exception("Fetch messages error")
         return []
-    finally:
-        if con:
-            con.close()
 
+@instrument
+def mark_read(user, other, upto_id):
+    """user ne other ke messages upto_id tak padh liye. Sirf conversation_state
+    ki ek row badalti hai; watermark aage badhe tabhi write hota hai.
+
+    Pehle senders wala conversation lock: warna chalti send ke commit ke baad
+    UPDATE naye last_message_id par dobara chalta hai par COUNT subquery purane
+    snapshot se - naya message gina nahi jaata aur unread 0 ho jaata."""
+    lo, hi = conversation_key(user, other)
+    try:
+        with transaction() as cur:
+            _lock_conversations(cur, [(user, other)])
+            cur.execute("""
+                UPDATE conversation_state SET
+                    read_upto = %(upto)s,
+                    unread = CASE WHEN %(upto)s >= last_message_id THEN 0 ELSE (
+                        SELECT COUNT(*) FROM messages
+                        WHERE user_lo=%(lo)s AND user_hi=%(hi)s AND id > %(upto)s
+                          AND sender=%(other)s AND receiver=%(user)s AND deleted_by_receiver=0
+                    ) END
+                WHERE owner=%(user)s AND peer=%(other)s AND read_upto < %(upto)s
+            """, {"user": user, "other": other, "upto": upto_id, "lo": lo, "hi": hi})
+            return cur.rowcount > 0
+    except Exception:
+        log.exception("Mark read error")
+        return False
+
+@instrument
 def get_unread_count(user, other):
-    con = None
-    try:
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("SELECT COUNT(*) FROM messages WHERE sender=%s AND receiver=%s AND is_read=0", (other, user))
-        count = cur.fetchone()[0]
-        return count
-    except:
+    try:
+        with transaction() as cur:
+            cur.execute("SELECT unread FROM conversation_state WHERE owner=%s AND peer=%s", (user, other))
+            row = cur.fetchone()
+        return row[0] if row else 0
+    except Exception:
+        log.exception("Unread count error")
         return 0
-    finally:
-        if con:
-            con.close()
 
 # ---------------- CONVERSATIONS ----------------
+@instrument
 def get_conversations(username):
-    con = None
     try:
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("""
-            SELECT DISTINCT uid FROM (
-                SELECT receiver AS uid FROM messages WHERE sender=%s
-                UNION
-                SELECT sender AS uid FROM messages WHERE receiver=%s
-            ) AS subquery
-        """, (username, username))
-        users = [row[0] for row in cur.fetchall()]
-        return users
-    except:
+        with transaction() as cur:
+            cur.execute("SELECT peer FROM conversation_state WHERE owner=%s", (username,))
+            return [row[0] for row in cur.fetchall()]
+    except Exception:
+        log.exception("Conversation list error")
         return []
-    finally:
-        if con:
-            con.close()
 
+@instrument
 def get_last_message(u1, u2):
-    con = None
+    """u1 ko dikhne wala aakhri message (clear karne ke baad wala hi)."""
     try:
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("""
-            SELECT msg, timestamp FROM messages
-            WHERE (sender=%s AND receiver=%s) OR (sender=%s AND receiver=%s)
-            ORDER BY timestamp DESC LIMIT 1
-        """, (u1, u2, u2, u1))
-        row = cur.fetchone()
-        return {"msg": row[0], "time": row[1]} if row else None
-    except:
+        with transaction() as cur:
+            cur.execute("""
+                SELECT last_preview, last_at, last_key_id FROM conversation_state
+                WHERE owner=%s AND peer=%s AND last_message_id > cleared_upto
+            """, (u1, u2))
+            row = cur.fetchone()
+        return {"msg": crypto.decrypt(row[0], row[2]), "time": row[1]} if row else None
+    except Exception:
+        log.exception("Last message error")
         return None
-    finally:
-        if con:
-            con.close()
 
+@instrument
+def get_conversation_summaries(user, limit=PAGE_SIZE, before=None):
+    """Conversation list: partner, last message preview, unread count.
+
+    conversation_state par ek index range scan. Clear ki hui conversations
+    (koi naya message nahi) skip hoti hain. Naye se purane order mein (last
+    message id se), aur before=<last id> agla page deta hai.
+    """
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    try:
+        with transaction(dict_rows=True) as cur:
+            cur.execute("""
+                SELECT peer, last_message_id, unread, last_preview, last_at, last_key_id
+                FROM conversation_state
+                WHERE owner=%(u)s AND last_message_id > cleared_upto
+                  AND (CAST(%(before)s AS BIGINT) IS NULL OR last_message_id < %(before)s)
+                ORDER BY last_message_id DESC
+                LIMIT %(limit)s
+            """, {"u": user, "before": before, "limit": limit})
+            rows = cur.fetchall()
+        with phase("crypto"):
+            previews = crypto.decrypt_many([(r['last_preview'], r['last_key_id']) for r in rows])
+        return [{"user": r['peer'], "unread": r['unread'],
+                 "last": {"id": r['last_message_id'], "msg": preview, "time": r['last_at']}}
+                for r, preview in zip(rows, previews)]
+    except Exception:
+        log.exception("Conversation summary error")
+        return []
+
+@instrument
 def delete_conversation(user, chat_with):
-    con = None
-    try:
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("UPDATE messages SET deleted_by_sender=1 WHERE sender=%s AND receiver=%s", (user, chat_with))
-        cur.execute("UPDATE messages SET deleted_by_receiver=1 WHERE sender=%s AND receiver=%s", (chat_with, user))
-        cur.execute("DELETE FROM messages WHERE deleted_by_sender=1 AND deleted_by_receiver=1")
-        con.commit()
-    finally:
-        if con:
-            con.close()
+    lo, hi = conversation_key(user, chat_with)
+    with transaction() as cur:
+        cur.execute("""
+            UPDATE messages SET deleted_by_sender=1
+            WHERE user_lo=%s AND user_hi=%s AND sender=%s AND deleted_by_sender=0
+        """, (lo, hi, user))
+        cur.execute("""
+            UPDATE messages SET deleted_by_receiver=1
+            WHERE user_lo=%s AND user_hi=%s AND receiver=%s AND deleted_by_receiver=0
+        """, (lo, hi, user))
+        cur.execute("""
+            UPDATE conversation_state
+            SET cleared_upto = last_message_id, unread = 0, read_upto = GREATEST(read_upto, last_message_id)
+            WHERE owner=%s AND peer=%s
+        """, (user, chat_with))
+        # Dono taraf se deleted rows `jobs.py compact` (cron) batches mein hatata hai
 
+@instrument
 def block_user(blocker, blocked):
-    con = None
-    try:
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("INSERT INTO blocks (blocker, blocked) VALUES (%s, %s)", (blocker, blocked))
-        con.commit()
-    finally:
-        if con:
-            con.close()
+    with transaction() as cur:
+        cur.execute("INSERT INTO blocks (blocker, blocked) VALUES (%s, %s) ON CONFLICT DO NOTHING", (blocker, blocked))
+        _invalidate(cur, "blocks", (blocker, blocked))
 
+@instrument
 def is_blocked(blocker, blocked):
-    con = None
+    """Cached - dekhein cache.py."""
+    key = (blocker, blocked)
+    result = cache.blocks.get(key)
+    if result is not cache.MISSING:
+        return result
+    _watch_invalidations()
+    generation = cache.blocks.generation
     try:
-        con = get_connection()
-        cur = con.cursor()
-        cur.execute("SELECT 1 FROM blocks WHERE blocker=%s AND blocked=%s", (blocker, blocked))
-        result = cur.fetchone() is not None
+        with transaction() as cur:
+            cur.execute("SELECT 1 FROM blocks WHERE blocker=%s AND blocked=%s", key)
+            result = cur.fetchone() is not None
+        cache.blocks.set(key, result, generation)
         return result
-    except:
+    except Exception:
+        log.exception("Block check error")
         return False
-    finally:
-        if con:
-            con.close()
\ No newline at end of file
+
+# ---------------- SEARCH ----------------
+@instrument
+def search_users(prefix, limit=search.USER_LIMIT):
+    """Username typeahead: prefix se shuru hone wale users (case-insensitive),
+    alphabetical. lower(username) index par ek range scan + LIMIT."""
+    limit = max(1, min(int(limit or search.USER_LIMIT), search.MAX_USER_LIMIT))
+    prefix = (prefix or "").strip()
+    if not prefix:
+        return []
+    if get_backend().name == "postgres":
+        column, prefix = 'lower(username) COLLATE "C"', search.fold(prefix)
+    else:
+        column, prefix = "lower(username)", search.fold(prefix, ascii_only=True)
+    try:
+        with transaction() as cur:
+            cur.execute(f"""
+                SELECT username FROM users WHERE {column} >= %s AND {column} < %s
+                ORDER BY {column} LIMIT %s
+            """, (*search.prefix_range(prefix), limit))
+            return [row[0] for row in cur.fetchall()]
+    except Exception:
+        log.exception("User search error")
+        return []
+
+@instrument
+def search_messages(user, query, before=None, limit=PAGE_SIZE):
+    """user ki conversations mein full-text search (saare words match hon).
+
+    Sirf user ko dikhne wale messages (deleted_by_* respect hote hain). Naye
+    se purane order mein; before=<last id> agla page deta hai. Result ka
+    format get_messages_between jaisa.
+    """
+    limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+    if not search.MESSAGE_SEARCH or not search.has_terms(query):
+        return []
+    try:
+        with transaction(dict_rows=True) as cur:
+            if get_backend().name == "postgres":
+                # websearch syntax: "exact phrase", or, -word
+                cur.execute(f"""
+                    SELECT id, sender, receiver, msg, timestamp, key_id FROM messages
+                    WHERE search @@ (websearch_to_tsquery('simple', %s) && CAST(%s AS tsquery))
+                      AND ((sender=%s AND deleted_by_sender=0) OR (receiver=%s AND deleted_by_receiver=0))
+                      {"AND id < %s" if before is not None else ""}
+                    ORDER BY id DESC LIMIT %s
+                """, [query, search.owner_token(user), user, user]
+                     + ([before] if before is not None else []) + [limit])
+            else:
+                # FTS5 rowid order mein chalta hai, join sirf deleted / hash collision check ke liye
+                cur.execute(f"""
+                    SELECT m.id, m.sender, m.receiver, m.msg, m.timestamp, m.key_id
+                    FROM messages_fts f JOIN messages m ON m.id = f.rowid
+                    WHERE messages_fts MATCH %s
+                      AND ((m.sender=%s AND m.deleted_by_sender=0) OR (m.receiver=%s AND m.deleted_by_receiver=0))
+                      {"AND f.rowid < %s" if before is not None else ""}
+                    ORDER BY f.rowid DESC LIMIT %s
+                """, [search.fts_query(user, query), user, user]
+                     + ([before] if before is not None else []) + [limit])
+            rows = cur.fetchall()
+        with phase("crypto"):
+            texts = crypto.decrypt_many([(r['msg'], r['key_id']) for r in rows])
+        return [{"id": r['id'], "from": r['sender'], "to": r['receiver'], "msg": text, "time": r['timestamp']}
+                for r, text in zip(rows, texts)]
+    except Exception:
+        log.exception("Message search error")
+        return []